@@ -16,8 +16,9 @@ from scipy.interpolate import make_interp_spline
 from matplotlib.dates import YearLocator, MonthLocator, DateFormatter
 from noticias_timeline import plota_timeline
 from noticias_processamento_texto import *
-from vaderSentimentptbr import SentimentIntensityAnalyzer 
-from sumarizador_textrankptbr import summarize_text_rank 
+from dados_referencia import le_planilha
+from vaderSentimentptbr import shared_analyzer
+from sumarizador_textrankptbr import summarize_text_rank, tabela_sentencas, seleciona_sentencas
 import re
 
 
@@ -26,7 +27,7 @@ def polaridade_sentimento_vaderptbr(texto_completo, titulo, resumir=True):
     Realiza a aplicação do VADER adaptado ao português
     '''
     
-    s = SentimentIntensityAnalyzer() 
+    s = shared_analyzer()
     if resumir:
         resumo = summarize_text_rank(texto_completo, compression=0.8, include_first_parag=True)
     else:
@@ -43,12 +44,63 @@ def polaridade_sentimento_vaderptbr(texto_completo, titulo, resumir=True):
     
     
 
-def pondera_polaridade_titulo_texto(pol_titulo, pol_texto):
+def polaridades_por_compressao(texto_completo, titulo, compressoes, incluir_primeiro_paragrafo=(True,)):
+    '''
+    Polaridade da noticia para cada taxa de compressao do sumario (e opcao de primeiro paragrafo).
+    O TextRank e o pre-processamento de cada sentenca sao feitos uma unica vez por noticia;
+    cada compressao apenas seleciona as sentencas e pontua os tokens ja preparados.
+    Selecoes iguais (comum entre compressoes proximas) sao pontuadas uma unica vez.
+    Obs.: as regras do VADER (n-gramas, 'mas', caixa alta) dependem do sumario inteiro,
+    por isso o cache e de tokens por sentenca e nao de valencias por sentenca
+    Retorna um DataFrame com as colunas compressao, primeiro_paragrafo e polaridade
+    '''
+    s = shared_analyzer()
+    pol_titulo = None if titulo is None else s.polarity_scores(titulo)['compound']
+
+    tabela = tabela_sentencas(texto_completo)
+    if tabela is None:
+        # texto curto: o sumario e o proprio texto, em qualquer compressao
+        pol_texto = s.polarity_scores(texto_completo)['compound']
+    else:
+        tokens = [s.fragment_tokens(sentenca) for sentenca in tabela.sentencas]
+        polaridade_selecao = {}
+
+    linhas = []
+    for primeiro_paragrafo in incluir_primeiro_paragrafo:
+        for compressao in compressoes:
+            if tabela is not None:
+                selecao = tuple(seleciona_sentencas(tabela, compressao, primeiro_paragrafo))
+                if selecao not in polaridade_selecao:
+                    polaridade_selecao[selecao] = s.polarity_scores_fragments([tokens[i] for i in selecao])['compound']
+                pol_texto = polaridade_selecao[selecao]
+            polaridade = pol_texto if pol_titulo is None else pondera_polaridade_titulo_texto(pol_titulo, pol_texto)
+            linhas.append((compressao, primeiro_paragrafo, polaridade))
+
+    return pd.DataFrame(linhas, columns=['compressao', 'primeiro_paragrafo', 'polaridade'])
+
+
+def varredura_compressao(dfNoticias, compressoes, incluir_primeiro_paragrafo=(True,), usar_titulo=True):
+    '''
+    Varredura das taxas de compressao do sumario sobre as noticias (colunas texto_completo e titulo).
+    Retorna uma linha por noticia e compressao, indexada pelo indice da noticia
+    '''
+    resultados = []
+    for indice, noticia in dfNoticias.iterrows():
+        titulo = noticia['titulo'] if usar_titulo else None
+        df = polaridades_por_compressao(noticia['texto_completo'], titulo, compressoes, incluir_primeiro_paragrafo)
+        df.index = [indice] * len(df)
+        resultados.append(df)
+    if not resultados:
+        return pd.DataFrame(columns=['compressao', 'primeiro_paragrafo', 'polaridade'])
+    return pd.concat(resultados)
+
+
+def pondera_polaridade_titulo_texto(pol_titulo, pol_texto, peso_titulo=0.2):
     '''
     Realiza a ponderação titulo e texto para calculo da polaridade do texto
     '''
     # pondera heuristicamente titulo e texto
-    return 0.2 * pol_titulo + 0.8 * pol_texto 
+    return peso_titulo * pol_titulo + (1 - peso_titulo) * pol_texto 
     
 
 
@@ -66,6 +118,87 @@ def classifica_sentimento_vaderptbr(polaridade, label_pos='POS', label_neu='NEU'
 
     
 
+def polaridades_titulo_texto(df, col_texto, col_titulo=None, resumir=True):
+    '''
+    Polaridades do titulo e do texto (sumarizado ou nao) de cada linha, calculadas uma unica vez
+    para serem usadas na varredura de pesos e thresholds.
+    Sem coluna de titulo, a polaridade do titulo e a propria polaridade do texto
+    (a ponderacao entao nao altera o resultado, como em polaridade_sentimento_vaderptbr)
+    '''
+    s = shared_analyzer()
+    textos = df[col_texto]
+    if resumir:
+        textos = textos.apply(lambda t : summarize_text_rank(t, compression=0.8, include_first_parag=True))
+    pol_textos = np.array([s.polarity_scores(t)['compound'] for t in textos], dtype=float)
+    if col_titulo is None:
+        return pol_textos.copy(), pol_textos
+    pol_titulos = np.array([s.polarity_scores(t)['compound'] for t in df[col_titulo]], dtype=float)
+    return pol_titulos, pol_textos
+
+
+def varredura_peso_threshold(pol_titulos, pol_textos, sentimentos, pesos_titulo, thresholds,
+                             label_pos='POS', label_neu='NEU', label_neg='NEG', media='binary'):
+    '''
+    Avalia todas as combinacoes de peso do titulo e threshold de uma vez (broadcasting NumPy),
+    com a mesma ponderacao de pondera_polaridade_titulo_texto e a mesma regra de
+    classifica_sentimento_vaderptbr.
+    media: 'binary' (metricas da classe label_pos) ou 'macro' (media das classes presentes
+    no gabarito ou na predicao), como no sklearn
+    Retorna um DataFrame com peso_titulo, threshold, acuracia, precisao, cobertura e f1
+    '''
+    pol_titulos = np.asarray(pol_titulos, dtype=float)
+    pol_textos = np.asarray(pol_textos, dtype=float)
+    pesos = np.asarray(pesos_titulo, dtype=float)
+    limiares = np.asarray(thresholds, dtype=float)
+
+    # polaridade ponderada: pesos x noticias
+    polaridade = pesos[:, None] * pol_titulos[None, :] + (1 - pesos[:, None]) * pol_textos[None, :]
+
+    # classe prevista (0 = neg, 1 = neu, 2 = pos): pesos x thresholds x noticias
+    polaridade = polaridade[:, None, :]
+    limite = limiares[None, :, None]
+    classe = np.ones(np.broadcast_shapes(polaridade.shape, limite.shape), dtype=np.int8)
+    classe[np.broadcast_to(polaridade > limite, classe.shape)] = 2
+    classe[np.broadcast_to(polaridade < -1*limite, classe.shape)] = 0
+
+    # rotulos previstos e reais como ids de um mesmo vocabulario (rotulos podem coincidir, ex.: neu = pos)
+    rotulos, gabarito = np.unique(np.concatenate([np.asarray(sentimentos, dtype=object),
+                                                  np.array([label_neg, label_neu, label_pos], dtype=object)]).astype(str),
+                                  return_inverse=True)
+    gabarito, ids_classes = gabarito[:-3], gabarito[-3:]
+    previsto = ids_classes[classe]
+
+    acertos = previsto == gabarito
+    acuracia = acertos.mean(axis=-1)
+
+    # contagens por rotulo: verdadeiros positivos, previstos e reais
+    vp = np.stack([(acertos & (gabarito == r)).sum(axis=-1) for r in range(len(rotulos))], axis=-1)
+    n_previstos = np.stack([(previsto == r).sum(axis=-1) for r in range(len(rotulos))], axis=-1)
+    n_reais = np.bincount(gabarito, minlength=len(rotulos))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precisao = np.where(n_previstos > 0, vp / n_previstos, 0.0)
+        cobertura = np.where(n_reais > 0, vp / n_reais, 0.0)
+        f1 = np.where(n_previstos + n_reais > 0, 2 * vp / (n_previstos + n_reais), 0.0)
+
+    if media == 'binary':
+        r = ids_classes[2]
+        precisao, cobertura, f1 = precisao[..., r], cobertura[..., r], f1[..., r]
+    elif media == 'macro':
+        presentes = (n_previstos > 0) | (n_reais > 0)
+        n_presentes = presentes.sum(axis=-1)
+        precisao = (precisao * presentes).sum(axis=-1) / n_presentes
+        cobertura = (cobertura * presentes).sum(axis=-1) / n_presentes
+        f1 = (f1 * presentes).sum(axis=-1) / n_presentes
+    else:
+        raise ValueError("media deve ser 'binary' ou 'macro'")
+
+    grade_pesos, grade_limiares = np.meshgrid(pesos, limiares, indexing='ij')
+    return pd.DataFrame({'peso_titulo': grade_pesos.ravel(), 'threshold': grade_limiares.ravel(),
+                         'acuracia': acuracia.ravel(), 'precisao': precisao.ravel(),
+                         'cobertura': cobertura.ravel(), 'f1': f1.ravel()})
+
+
 def gera_curva_polaridade_media(dfNoticiasComPolaridade, empresa, dimensao, maxima_data=None, alfa=0.1, grau_polinomio=5):
     '''
     Gera a curva de polaridade média - modelo EWMA e interpolação
@@ -157,7 +290,7 @@ def filtrar_noticias_pos_coleta(dfNoticias):
    
 
     # trata empresas que estao associadas a termos genericos sem relacao com ela
-    dfPadroesExcluir = pd.read_excel('datasets/palavras_chave_excluir_empresa.xlsx')
+    dfPadroesExcluir = le_planilha('datasets/palavras_chave_excluir_empresa.xlsx')
     dfFiltrado['excluir_texto'] = False
     dfFiltrado['excluir_titulo'] = False
 
@@ -182,7 +315,7 @@ def filtrar_noticias_pos_coleta(dfNoticias):
 
     # trata empresas que estao associadas a termos genericos, e que precisam de lista de palavras pra detecta-las
     # exemplo azul linhas aereas, ao buscar apenas por azul retorna-se muitas noticias nao relacionadas
-    dfPadroesExcluir = pd.read_excel('datasets/palavras_chave_incluir_empresa.xlsx')
+    dfPadroesExcluir = le_planilha('datasets/palavras_chave_incluir_empresa.xlsx')
     dfFiltrado['excluir_texto'] = False
 
     padrao = ''
@@ -6,19 +6,25 @@ Trabalho de conclusão de curso - MBA Digital Business USP Esalq
 '''
 
 
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify
 import os
-import pandas as pd
 import datetime as dt
 from analise_sentimento_modelo import gera_curva_polaridade_media
 from noticias_graficos import *
 from noticias_wordcloud import *
+from servico_sentimento import LoteadorSentimento
+from dados_referencia import le_planilha
 
 base_noticias_saida = 'datasets/sentimento_base_noticias.xlsx'
-df = pd.read_excel(base_noticias_saida)
+df = le_planilha(base_noticias_saida)
 
 app = Flask(__name__)
 
+# pontuacao sob demanda: pedidos concorrentes sao agrupados em micro-lotes
+loteador = LoteadorSentimento()
+# carrega o analisador (lexico e caches) na subida, e nao no primeiro pedido
+loteador.inicia()
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     '''
@@ -75,6 +81,44 @@ def index():
     return render_template('index.html', nomes=nomes_empresas)
 
 
+@app.route('/api/sentimento', methods=['POST'])
+def api_sentimento():
+    '''
+    Pontua textos em portugues com o mesmo pipeline do modelo (sumario TextRank + VADER)
+    Corpo JSON: {"texto": "..."} ou {"textos": ["...", ...]}, opcionalmente "resumir": false
+    Retorna compound, neg, neu e pos de cada texto
+    '''
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict) or ('texto' in dados) == ('textos' in dados):
+        return jsonify({'erro': 'informe "texto" ou "textos"'}), 400
+
+    unico = 'texto' in dados
+    textos = [dados['texto']] if unico else dados['textos']
+    if not isinstance(textos, list) or not all(isinstance(t, str) for t in textos):
+        return jsonify({'erro': 'os textos devem ser strings'}), 400
+
+    resumir = dados.get('resumir', True)
+    if not isinstance(resumir, bool):
+        return jsonify({'erro': '"resumir" deve ser true ou false'}), 400
+
+    try:
+        resultados = loteador.pontua(textos, resumir=resumir)
+    except TimeoutError as e:
+        return jsonify({'erro': str(e)}), 503
+
+    if unico:
+        return jsonify({'resultado': resultados[0]})
+    return jsonify({'resultados': resultados})
+
+
+@app.route('/api/metricas', methods=['GET'])
+def api_metricas():
+    '''
+    Metricas do servico de pontuacao: contadores, latencia e tamanho dos micro-lotes
+    '''
+    return jsonify(loteador.metricas())
+
+
 def formato_tabela(n):
     '''
     Define o Formato da tabela (heatmap) de acordo com polaridade
@@ -0,0 +1,170 @@
+'''
+Módulo de cache em disco (SQLite) para resultados caros de recalcular, como sumários e lemas
+As chaves são hashes do conteúdo e dos parâmetros usados, então textos novos ou editados
+geram chaves novas e nada precisa ser invalidado manualmente
+Projeto Análise de sentimentos sobre notícias do tema ESG
+Trabalho de conclusão de curso - MBA Digital Business USP Esalq
+'''
+
+import os
+import sqlite3
+import hashlib
+import pickle
+import threading
+
+
+def chave_conteudo(*partes):
+    '''
+    Chave de cache (hash sha1) de um conteudo e seus parametros
+    '''
+    h = hashlib.sha1()
+    for parte in partes:
+        h.update(repr(parte).encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+class CacheDisco(object):
+    '''
+    Cache chave -> valor (pickle) persistido em um arquivo SQLite
+    Leituras e escritas em lote (get_many/put_many) usam uma unica transacao
+    max_bytes: tamanho maximo dos valores; acima dele saem os menos acessados recentemente
+    '''
+
+    # limite de variaveis por comando no SQLite
+    TAMANHO_LOTE = 500
+
+    # segundos aguardando a trava do arquivo quando outro processo grava (ex.: workers do pontuador)
+    TEMPO_ESPERA = 120
+
+    def __init__(self, caminho, max_bytes=None):
+        self.caminho = caminho
+        self.max_bytes = max_bytes
+        self.trava = threading.Lock()
+        pasta = os.path.dirname(os.path.abspath(caminho))
+        os.makedirs(pasta, exist_ok=True)
+        self.conexao = sqlite3.connect(caminho, timeout=self.TEMPO_ESPERA, check_same_thread=False)
+        # WAL: leitores nao bloqueiam o escritor e varios processos podem compartilhar o arquivo
+        self.conexao.execute('PRAGMA journal_mode=WAL')
+        with self.conexao:
+            self.conexao.execute('CREATE TABLE IF NOT EXISTS cache (chave TEXT PRIMARY KEY, valor BLOB)')
+            colunas = [linha[1] for linha in self.conexao.execute('PRAGMA table_info(cache)')]
+            if 'tamanho' not in colunas:
+                self.conexao.execute('ALTER TABLE cache ADD COLUMN tamanho INTEGER DEFAULT 0')
+                self.conexao.execute('UPDATE cache SET tamanho = LENGTH(valor)')
+            if 'acesso' not in colunas:
+                self.conexao.execute('ALTER TABLE cache ADD COLUMN acesso INTEGER DEFAULT 0')
+            self.conexao.execute('CREATE INDEX IF NOT EXISTS cache_acesso ON cache (acesso)')
+        # relogio logico dos acessos (ordem de remocao)
+        self.relogio = self.conexao.execute('SELECT COALESCE(MAX(acesso), 0) FROM cache').fetchone()[0]
+        # total dos valores mantido em memoria (sem varrer a tabela a cada gravacao)
+        self.total_bytes = self._soma_tamanhos()
+
+    def _soma_tamanhos(self):
+        return self.conexao.execute('SELECT COALESCE(SUM(tamanho), 0) FROM cache').fetchone()[0]
+
+    def get(self, chave, default=None):
+        return self.get_many([chave]).get(chave, default)
+
+    def get_many(self, chaves):
+        '''
+        Dicionario chave -> valor das chaves encontradas
+        '''
+        chaves = list(dict.fromkeys(chaves))
+        encontrados = {}
+        with self.trava:
+            for i in range(0, len(chaves), self.TAMANHO_LOTE):
+                lote = chaves[i:i + self.TAMANHO_LOTE]
+                consulta = 'SELECT chave, valor FROM cache WHERE chave IN ({0})'.format(','.join('?' * len(lote)))
+                for chave, valor in self.conexao.execute(consulta, lote):
+                    encontrados[chave] = pickle.loads(valor)
+            if encontrados and self.max_bytes is not None:
+                self.relogio += 1
+                with self.conexao:
+                    self.conexao.executemany('UPDATE cache SET acesso = ? WHERE chave = ?',
+                                             [(self.relogio, chave) for chave in encontrados])
+        return encontrados
+
+    def put(self, chave, valor):
+        self.put_many({chave: valor})
+
+    def put_many(self, itens):
+        '''
+        Grava os pares chave -> valor (dict ou lista de pares)
+        '''
+        if isinstance(itens, dict):
+            itens = itens.items()
+        with self.trava:
+            self.relogio += 1
+            linhas = {}
+            for chave, valor in itens:
+                dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+                linhas[chave] = (chave, sqlite3.Binary(dados), len(dados), self.relogio)
+            if not linhas:
+                return
+            with self.conexao:
+                # tamanho dos valores substituidos (busca pela chave primaria)
+                substituidos = 0
+                chaves = list(linhas)
+                for i in range(0, len(chaves), self.TAMANHO_LOTE):
+                    lote = chaves[i:i + self.TAMANHO_LOTE]
+                    consulta = 'SELECT COALESCE(SUM(tamanho), 0) FROM cache WHERE chave IN ({0})'.format(','.join('?' * len(lote)))
+                    substituidos += self.conexao.execute(consulta, lote).fetchone()[0]
+                self.conexao.executemany('INSERT OR REPLACE INTO cache (chave, valor, tamanho, acesso) VALUES (?, ?, ?, ?)', linhas.values())
+                self.total_bytes += sum(linha[2] for linha in linhas.values()) - substituidos
+                self._remove_excesso()
+
+    def _remove_excesso(self):
+        # remove os itens acessados ha mais tempo ate o total caber em max_bytes
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+        # outro processo pode ter gravado no mesmo arquivo: confirma o total antes de remover
+        total = self.total_bytes = self._soma_tamanhos()
+        if total <= self.max_bytes:
+            return
+        remover = []
+        for chave, tamanho in self.conexao.execute('SELECT chave, tamanho FROM cache ORDER BY acesso'):
+            if total <= self.max_bytes:
+                break
+            remover.append((chave,))
+            total -= tamanho
+        self.conexao.executemany('DELETE FROM cache WHERE chave = ?', remover)
+        self.total_bytes = total
+
+    def tamanho_bytes(self):
+        with self.trava:
+            return self._soma_tamanhos()
+
+    def __contains__(self, chave):
+        with self.trava:
+            return self.conexao.execute('SELECT 1 FROM cache WHERE chave = ?', (chave,)).fetchone() is not None
+
+    def __len__(self):
+        with self.trava:
+            return self.conexao.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def clear(self):
+        with self.trava, self.conexao:
+            self.conexao.execute('DELETE FROM cache')
+            self.total_bytes = 0
+
+    def close(self):
+        self.conexao.close()
+
+
+_caches = {}
+_trava_caches = threading.Lock()
+
+
+def cache_compartilhado(caminho, max_bytes=None):
+    '''
+    CacheDisco aberto uma unica vez por processo para cada arquivo
+    '''
+    chave = os.path.abspath(caminho)
+    with _trava_caches:
+        cache = _caches.get(chave)
+        if cache is None:
+            cache = _caches[chave] = CacheDisco(caminho, max_bytes)
+        elif max_bytes is not None:
+            cache.max_bytes = max_bytes
+        return cache
@@ -59,7 +59,7 @@ def treina_classificador_esg(df, df_nao_rotulado, col_texto, col_classe='Dimens
     df = df[~pd.isnull(df['texto_ajustado'])]
     df['texto_ajustado'] = df['texto_ajustado'].apply(str.lower)
     df['texto_ajustado'] = df['texto_ajustado'].apply(limpar_texto)
-    df['texto_ajustado'] = df['texto_ajustado'].apply(lematizador)
+    df['texto_ajustado'] = lematizar_lote(df['texto_ajustado'])
 
     i = 0
     while(i < max_iter):
@@ -108,7 +108,7 @@ def treina_classificador_esg(df, df_nao_rotulado, col_texto, col_classe='Dimens
             df_automatico['texto_ajustado'] = df_automatico['texto_completo']
             df_automatico['texto_ajustado'] = df_automatico['texto_ajustado'].apply(str.lower)
             df_automatico['texto_ajustado'] = df_automatico['texto_ajustado'].apply(limpar_texto)
-            df_automatico['texto_ajustado'] = df_automatico['texto_ajustado'].apply(lematizador)
+            df_automatico['texto_ajustado'] = lematizar_lote(df_automatico['texto_ajustado'])
             df_automatico = df_automatico.loc[:, ['texto_ajustado', 'classificacao']]
             df_automatico = df_automatico.rename(columns={'classificacao': col_classe})
 
@@ -147,7 +147,7 @@ def aplica_classificador_esg(vect, model, df_teste,
     # teste
     df_teste[col_texto_saida] = df_teste[col_texto_origem].apply(str.lower)
     df_teste[col_texto_saida] = df_teste[col_texto_saida].apply(limpar_texto)
-    df_teste[col_texto_saida] = df_teste[col_texto_saida].apply(lematizador)
+    df_teste[col_texto_saida] = lematizar_lote(df_teste[col_texto_saida])
     
     X_test = df_teste[col_texto_saida]
     X_test_dtm = vect.transform(X_test)
@@ -0,0 +1,129 @@
+'''
+Módulo de carga das planilhas de referência da pasta datasets (termos ESG, lista de empresas,
+apelidos, termos de inclusão/exclusão, escores)
+Cada planilha é lida com o openpyxl uma única vez e gravada em uma cópia binária (pickle) em
+datasets/.cache/planilhas; a cópia é refeita quando o arquivo muda (data de modificação e,
+se ela mudar, o hash do conteúdo). Dentro do processo os DataFrames ficam em memória e cada
+chamada recebe uma cópia, que pode ser alterada livremente
+Projeto Análise de sentimentos sobre notícias do tema ESG
+Trabalho de conclusão de curso - MBA Digital Business USP Esalq
+'''
+
+import os
+import glob
+import hashlib
+import pickle
+import threading
+import pandas as pd
+from cache_disco import chave_conteudo
+
+PASTA_DADOS = 'datasets'
+PASTA_CACHE_PLANILHAS = 'datasets/.cache/planilhas'
+
+# planilhas usadas pelo processamento das noticias (aquecidas por padrao)
+PLANILHAS_REFERENCIA = ['datasets/palavras_chave_esg.xlsx',
+                        'datasets/lista_empresas.xlsx',
+                        'datasets/apelidos_empresas.xlsx',
+                        'datasets/palavras_chave_excluir_empresa.xlsx',
+                        'datasets/palavras_chave_incluir_empresa.xlsx',
+                        'datasets/EscoreB3.xlsx']
+
+_memoria = {}
+_trava = threading.Lock()
+
+
+def assinatura_arquivo(caminho):
+    '''
+    Data de modificacao (ns) e tamanho do arquivo
+    '''
+    info = os.stat(caminho)
+    return (info.st_mtime_ns, info.st_size)
+
+
+def hash_arquivo(caminho):
+    h = hashlib.sha1()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _arquivo_cache(caminho, parametros):
+    nome = os.path.splitext(os.path.basename(caminho))[0]
+    return os.path.join(PASTA_CACHE_PLANILHAS, nome + '-' + chave_conteudo(os.path.abspath(caminho), parametros)[:12] + '.pkl')
+
+
+def _grava_cache(arquivo, item):
+    os.makedirs(os.path.dirname(os.path.abspath(arquivo)), exist_ok=True)
+    temporario = arquivo + '.tmp{0}'.format(os.getpid())
+    with open(temporario, 'wb') as f:
+        pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporario, arquivo)
+
+
+def _carrega(caminho, parametros, assinatura):
+    '''
+    DataFrame da copia binaria, se ainda valida; senao le a planilha e refaz a copia
+    '''
+    arquivo = _arquivo_cache(caminho, parametros)
+    item = None
+    if os.path.exists(arquivo):
+        try:
+            with open(arquivo, 'rb') as f:
+                item = pickle.load(f)
+        except Exception:
+            # copia corrompida ou de outra versao do pandas: le de novo
+            item = None
+
+    if item is not None and item['assinatura'] == assinatura:
+        return item
+
+    conteudo = hash_arquivo(caminho)
+    if item is not None and item['hash'] == conteudo:
+        # arquivo copiado ou salvo sem alteracoes: so atualiza a assinatura
+        item['assinatura'] = assinatura
+    else:
+        item = {'assinatura': assinatura, 'hash': conteudo, 'df': pd.read_excel(caminho, **dict(parametros))}
+    _grava_cache(arquivo, item)
+    return item
+
+
+def le_planilha(caminho, copia=True, **kwargs):
+    '''
+    Le a planilha (mesmos parametros do pd.read_excel) pela memoria do processo ou pela copia binaria
+    copia=False retorna o DataFrame compartilhado, que nao deve ser alterado
+    '''
+    parametros = tuple(sorted(kwargs.items()))
+    chave = (os.path.abspath(caminho), parametros)
+    assinatura = assinatura_arquivo(caminho)
+    with _trava:
+        item = _memoria.get(chave)
+        if item is None or item['assinatura'] != assinatura:
+            item = _memoria[chave] = _carrega(caminho, parametros, assinatura)
+    return item['df'].copy() if copia else item['df']
+
+
+def aquece(caminhos=None, pasta=None):
+    '''
+    Carrega as planilhas na memoria do processo (ex.: na inicializacao de um servico)
+    caminhos: lista de planilhas (padrao: PLANILHAS_REFERENCIA); pasta: todas as planilhas da pasta
+    Retorna os caminhos carregados
+    '''
+    if pasta is not None:
+        caminhos = sorted(glob.glob(os.path.join(pasta, '*.xlsx')))
+    elif caminhos is None:
+        caminhos = PLANILHAS_REFERENCIA
+    carregados = []
+    for caminho in caminhos:
+        if os.path.exists(caminho):
+            le_planilha(caminho, copia=False)
+            carregados.append(caminho)
+    return carregados
+
+
+def descarta_memoria():
+    '''
+    Libera os DataFrames mantidos em memoria (as copias binarias continuam em disco)
+    '''
+    with _trava:
+        _memoria.clear()
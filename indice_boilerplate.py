@@ -0,0 +1,135 @@
+'''
+Módulo do índice de linhas repetidas (boilerplate) por fonte de notícias
+Textos extraídos com o newspaper trazem rodapés próprios de cada fonte (botões de compartilhar,
+"Imprimir", "Mais", listas de redes sociais, créditos de imagem), que inflam todas as etapas
+seguintes. O índice conta, por fonte, em quantas notícias cada linha aparece e remove as linhas
+presentes em mais de uma fração (limiar) das notícias da fonte, antes da sumarização,
+classificação e pontuação. Pode ser atualizado incrementalmente com novas notícias
+Projeto Análise de sentimentos sobre notícias do tema ESG
+Trabalho de conclusão de curso - MBA Digital Business USP Esalq
+'''
+
+import re
+import hashlib
+import pickle
+from collections import Counter
+import pandas as pd
+
+RE_ESPACOS = re.compile(r'\s+')
+
+
+def hash_linha(linha):
+    '''
+    Hash da linha normalizada (sem espacos extras e em minusculas), None para linha vazia
+    '''
+    linha = RE_ESPACOS.sub(' ', linha).strip().lower()
+    if not linha:
+        return None
+    return hashlib.blake2b(linha.encode('utf-8'), digest_size=8).digest()
+
+
+def hash_noticia(texto):
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).digest()
+
+
+class IndiceBoilerplate(object):
+    '''
+    Contagem, por fonte, do numero de noticias em que cada linha aparece
+    limiar: fracao das noticias da fonte acima da qual a linha e considerada boilerplate
+    min_noticias: numero minimo de noticias da fonte para remover alguma linha
+    '''
+
+    def __init__(self, limiar=0.5, min_noticias=5):
+        self.limiar = limiar
+        self.min_noticias = min_noticias
+        self.linhas = {}          # fonte -> Counter(hash da linha -> noticias)
+        self.noticias = {}        # fonte -> set(hash das noticias contadas)
+        self._repetidas = {}      # fonte -> linhas acima do limiar (recalculado sob demanda)
+
+    def _hashes(self, texto):
+        return set(h for h in map(hash_linha, texto.split('\n')) if h is not None)
+
+    def adiciona(self, fonte, texto):
+        '''
+        Conta as linhas de uma noticia (uma mesma noticia so e contada uma vez)
+        '''
+        if not isinstance(texto, str):
+            return
+        noticia = hash_noticia(texto)
+        vistas = self.noticias.setdefault(fonte, set())
+        if noticia in vistas:
+            return
+        vistas.add(noticia)
+        self.linhas.setdefault(fonte, Counter()).update(self._hashes(texto))
+        self._repetidas.pop(fonte, None)
+
+    def remove(self, fonte, texto):
+        '''
+        Descontabiliza uma noticia (ex.: antes de adicionar a sua versao editada)
+        '''
+        if not isinstance(texto, str):
+            return
+        noticia = hash_noticia(texto)
+        vistas = self.noticias.get(fonte, set())
+        if noticia not in vistas:
+            return
+        vistas.remove(noticia)
+        contagem = self.linhas[fonte]
+        contagem.subtract(self._hashes(texto))
+        for h in [h for h, n in contagem.items() if n <= 0]:
+            del contagem[h]
+        self._repetidas.pop(fonte, None)
+
+    def adiciona_noticias(self, df, col_fonte='fonte', col_texto='texto_completo'):
+        '''
+        Atualiza o indice com as noticias do DataFrame (as ja contadas sao ignoradas)
+        '''
+        for fonte, texto in zip(df[col_fonte], df[col_texto]):
+            self.adiciona(fonte, texto)
+        return self
+
+    def linhas_repetidas(self, fonte):
+        '''
+        Hashes das linhas que aparecem em mais de limiar das noticias da fonte
+        '''
+        repetidas = self._repetidas.get(fonte)
+        if repetidas is None:
+            total = len(self.noticias.get(fonte, ()))
+            if total < self.min_noticias:
+                repetidas = frozenset()
+            else:
+                minimo = self.limiar * total
+                repetidas = frozenset(h for h, n in self.linhas[fonte].items() if n > minimo)
+            self._repetidas[fonte] = repetidas
+        return repetidas
+
+    def limpa(self, fonte, texto):
+        '''
+        Texto sem as linhas de boilerplate da fonte
+        '''
+        if not isinstance(texto, str):
+            return texto
+        repetidas = self.linhas_repetidas(fonte)
+        if not repetidas:
+            return texto
+        return '\n'.join(l for l in texto.split('\n') if hash_linha(l) not in repetidas)
+
+    def limpa_noticias(self, df, col_fonte='fonte', col_texto='texto_completo'):
+        '''
+        Textos do DataFrame sem o boilerplate de cada fonte (Series com o mesmo indice)
+        '''
+        return pd.Series([self.limpa(fonte, texto) for fonte, texto in zip(df[col_fonte], df[col_texto])], index=df.index)
+
+    def salvar(self, caminho):
+        with open(caminho, 'wb') as f:
+            pickle.dump({'limiar': self.limiar, 'min_noticias': self.min_noticias,
+                         'linhas': self.linhas, 'noticias': self.noticias}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def carregar(cls, caminho):
+        with open(caminho, 'rb') as f:
+            estado = pickle.load(f)
+        indice = cls(estado['limiar'], estado['min_noticias'])
+        indice.linhas = estado['linhas']
+        indice.noticias = estado['noticias']
+        return indice
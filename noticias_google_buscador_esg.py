@@ -12,7 +12,8 @@ import re
 import unidecode
 import datetime as dt
 from noticias_google_buscador import busca_noticias_google_news
-from noticias_processamento_texto import remove_acentos, remove_termos_comuns, aplica_stemming_texto, remove_palavras_texto, conta_termos_esg, classifica_texto, classifica_textos_coletados, filtra_noticias_nao_relacionadas, filtra_noticias_sem_classificacao, conta_mencoes_empresas, filtra_citacao_relevante, remove_nome_composto
+from dados_referencia import le_planilha
+from noticias_processamento_texto import remove_acentos, remove_termos_comuns, aplica_stemming_texto, remove_palavras_texto, conta_termos_esg, classifica_texto, classifica_textos_coletados, filtra_noticias_nao_relacionadas, filtra_noticias_sem_classificacao, conta_mencoes_empresas, filtra_citacao_relevante, remove_nome_composto, registro_empresas, chave_empresa
 
 warnings.filterwarnings('ignore')
 arquivo_termos_esg = 'datasets/palavras_chave_esg.xlsx'
@@ -37,7 +38,7 @@ def recupera_lista_empresas_B3():
     new_row = {'Código':'Nubank', 'Nome': 'Nubank' }
     df = df.append(new_row, ignore_index=True)    
     
-    df = pd.merge(left=df, right=pd.read_excel('datasets/EscoreB3.xlsx'), on='Código', how='left')
+    df = pd.merge(left=df, right=le_planilha('datasets/EscoreB3.xlsx'), on='Código', how='left')
     
     df['Nome'] = df['Nome'].replace('AMER3', 'Lojas Americanas')
     df['Nome'] = df['Nome'].apply(lambda x : 'Lojas Americanas' if x == 'Americanas' else x)
@@ -100,7 +101,7 @@ def busca_noticias_google_esg(empresa_pesquisada, atualiza=False, ultima_data=No
     '''
     Busca as noticias do google 
     '''
-    dfTermos = pd.read_excel(arquivo_termos_esg)
+    dfTermos = le_planilha(arquivo_termos_esg)
     
     empresa_pesquisada_aju = empresa_pesquisada.replace(' ', '+')
     empresa_pesquisada_aju = empresa_pesquisada.replace('&', '%26')
@@ -118,7 +119,7 @@ def busca_noticias_google_esg(empresa_pesquisada, atualiza=False, ultima_data=No
     if len(dfESG) > 0:
         dfESG = dfESG.sort_values(by='data_publicacao')  #ordena
 
-        dfESG['empresa'] = remove_acentos(empresa_pesquisada.lower())
+        dfESG['empresa'] = chave_empresa(empresa_pesquisada)
     
     return dfESG
 
@@ -191,10 +192,11 @@ def processa_busca_empresa(empresa, dfEmpresasListadas, atualiza=False, apenas_t
     #print('recuperando texto noticia empresa ' + empresa + ' ' + str(dt.datetime.now()))
     df = recupera_noticias_completas(df, apenas_titulos)
     if len(df) > 0:
+        registro = registro_empresas(dfEmpresasListadas)
         #print('filtando texto noticia empresa ' + empresa + ' ' + str(dt.datetime.now()))
-        df = filtra_noticias_nao_relacionadas(df, empresa, apenas_titulos)
+        df = filtra_noticias_nao_relacionadas(df, empresa, apenas_titulos, registro=registro)
         if not apenas_titulos:
-            df = filtra_citacao_relevante(df, empresa, dfEmpresasListadas )
+            df = filtra_citacao_relevante(df, empresa, dfEmpresasListadas, registro=registro)
         #print('classifica texto noticia empresa ' + empresa + ' ' + str(dt.datetime.now()))
         df = classifica_textos_coletados(df, apenas_titulos)
         #print('fim texto noticia empresa ' + empresa + ' ' + str(dt.datetime.now()))
@@ -14,6 +14,14 @@ import unidecode
 import datetime as dt
 import spacy
 import string
+import os
+import sys
+import pickle
+import atexit
+from collections import OrderedDict
+import scipy.sparse as sp
+from cache_disco import cache_compartilhado, chave_conteudo
+from dados_referencia import le_planilha
 nltk.download('rslp')
 nltk.download('punkt')
 nltk.download('stopwords')
@@ -54,12 +62,75 @@ def limpar_texto(text):
 
 
 
-def lematizador(text):
+# componentes do pipeline que nao influenciam a classe gramatical nem o lema
+COMPONENTES_DESATIVADOS_LEMATIZACAO = ['parser', 'ner']
+
+# cache em disco dos textos lematizados (removidos os menos usados acima do tamanho maximo)
+CACHE_LEMAS = 'datasets/.cache/lemas.sqlite'
+TAMANHO_MAX_CACHE_LEMAS = 256 * 1024 * 1024
+
+# memoria (LRU) hash do texto -> texto lematizado: documentos e frases repetidos nao passam pelo tagger
+# limitada em bytes: e so a primeira camada, as demais repeticoes vem do cache em disco
+TAMANHO_MAX_MEMO_LEMAS = 16 * 1024 * 1024
+
+
+class MemoriaLemas(object):
     '''
-    Lematizador utilizando spacy
+    LRU em memoria chave (hash do texto) -> texto lematizado, limitada pelo tamanho
+    das chaves e lemas guardados (os textos originais nao ficam na memoria)
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._dados = OrderedDict()
+
+    @staticmethod
+    def _tamanho(chave, lema):
+        return sys.getsizeof(chave) + sys.getsizeof(lema)
+
+    def get(self, chave):
+        lema = self._dados.get(chave)
+        if lema is not None:
+            self._dados.move_to_end(chave)
+        return lema
+
+    def put(self, chave, lema):
+        tamanho = self._tamanho(chave, lema)
+        if tamanho > self.max_bytes:
+            return
+        anterior = self._dados.pop(chave, None)
+        if anterior is not None:
+            self.total_bytes -= self._tamanho(chave, anterior)
+        self._dados[chave] = lema
+        self.total_bytes += tamanho
+        while self.total_bytes > self.max_bytes:
+            antiga, lema_antigo = self._dados.popitem(last=False)
+            self.total_bytes -= self._tamanho(antiga, lema_antigo)
+
+    def clear(self):
+        self._dados.clear()
+        self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._dados)
+
+
+_memo_lemas = MemoriaLemas(TAMANHO_MAX_MEMO_LEMAS)
+
+
+def versao_modelo_lematizacao():
+    '''
+    Identificacao do modelo spacy, parte da chave do cache (outro modelo gera outros lemas)
+    '''
+    return (spacy.__version__, nlp.meta.get('lang'), nlp.meta.get('name'), nlp.meta.get('version'))
+
+
+def _lematiza_doc(doc):
+    '''
+    Texto com os verbos substituidos pelo lema
     '''
     sent = []
-    doc = nlp(text)
     for word in doc:
         if word.pos_ == "VERB":
             sent.append(word.lemma_)
@@ -68,6 +139,61 @@ def lematizador(text):
     return " ".join(sent)
 
 
+def lematizar_lote(textos, batch_size=64, n_process=1, cache=CACHE_LEMAS):
+    '''
+    Lematiza varios textos com nlp.pipe, em lotes e opcionalmente em varios processos,
+    apenas com os componentes necessarios (sem parser e NER)
+    Textos repetidos sao lematizados uma unica vez: consulta primeiro a memoria do processo e
+    depois o cache em disco (ambos pela chave hash do texto e versao do modelo), e so os que faltam vao ao spacy
+    cache: caminho do arquivo de cache, CacheDisco ou None (sem cache em disco)
+    Retorna uma lista (ou Series com o mesmo indice, se textos for Series)
+    '''
+    indice = textos.index if isinstance(textos, pd.Series) else None
+    textos = list(textos)
+
+    versao = versao_modelo_lematizacao()
+    chaves = {t: chave_conteudo(t, versao) for t in textos}
+
+    lemas = {}
+    for texto, chave in chaves.items():
+        lema = _memo_lemas.get(chave)
+        if lema is not None:
+            lemas[texto] = lema
+    faltantes = [t for t in chaves if t not in lemas]
+
+    if faltantes and cache is not None:
+        if isinstance(cache, str):
+            cache = cache_compartilhado(cache, TAMANHO_MAX_CACHE_LEMAS)
+        encontrados = cache.get_many([chaves[t] for t in faltantes])
+        for texto in faltantes:
+            if chaves[texto] in encontrados:
+                lemas[texto] = encontrados[chaves[texto]]
+                _memo_lemas.put(chaves[texto], lemas[texto])
+        faltantes = [t for t in faltantes if t not in lemas]
+
+    if faltantes:
+        desativados = [c for c in COMPONENTES_DESATIVADOS_LEMATIZACAO if c in nlp.pipe_names]
+        docs = nlp.pipe(faltantes, batch_size=batch_size, n_process=n_process, disable=desativados)
+        novos = {}
+        for texto, doc in zip(faltantes, docs):
+            lemas[texto] = novos[texto] = _lematiza_doc(doc)
+            _memo_lemas.put(chaves[texto], lemas[texto])
+        if cache is not None:
+            cache.put_many((chaves[t], lema) for t, lema in novos.items())
+
+    lemas = [lemas[t] for t in textos]
+    if indice is not None:
+        return pd.Series(lemas, index=indice)
+    return lemas
+
+
+def lematizador(text):
+    '''
+    Lematizador utilizando spacy
+    '''
+    return lematizar_lote([text])[0]
+
+
 
 def remove_acentos(texto):
     '''
@@ -94,12 +220,16 @@ def lista_stopwords_classificador_esg():
     return list(spacy.lang.pt.stop_words.STOP_WORDS) + ['abc', 'xyz', 'def', 'caracteres', 'empresa']
     
 
+# nomes de empresas que tambem sao palavras comuns (nao contam como citacao de outra empresa)
+TERMOS_COMUNS_EMPRESAS = ['le', 'paulo','investimentos', 'brasil', 'carlos', 'rede', 'rio', 'ser', 'pao', 'time', 'joao', 'viver', 'rumo', 'oi', 'santos', 'porto', 'soma', 'construtora', 'transmissao', 'blue', 'pague', 'smart', 'log', 'nacional', 'siderurgica', 'mateus', 'cury', 'mundial', 'boa', 'caixa']
+
+
 def remove_termos_comuns(lista_empresas):
     '''
     Remove termos comuns para não pesquisar
     '''
     
-    stopw = ['le', 'paulo','investimentos', 'brasil', 'carlos', 'rede', 'rio', 'ser', 'pao', 'time', 'joao', 'viver', 'rumo', 'oi', 'santos', 'porto', 'soma', 'construtora', 'transmissao', 'blue', 'pague', 'smart', 'log', 'nacional', 'siderurgica', 'mateus', 'cury', 'mundial', 'boa', 'caixa']
+    stopw = TERMOS_COMUNS_EMPRESAS
     result = lista_empresas
     
     for w in stopw:
@@ -135,12 +265,98 @@ def remove_nome_composto(nome_composto):
         
     
 
+# tabela palavra -> radical do RSLP, reaproveitada entre execucoes
+ARQUIVO_MEMO_STEMMING = 'datasets/.cache/stemming_rslp.pkl'
+
+
+class StemmerMemoizado(object):
+    '''
+    RSLPStemmer com tabela palavra -> radical: cada palavra distinta passa pelas regras
+    do RSLP uma unica vez, e a tabela pode ser salva e carregada entre execucoes
+    '''
+
+    def __init__(self, memo=None):
+        self.memo = {} if memo is None else memo
+        self.novos = 0
+        self._stemmer = None
+
+    @property
+    def stemmer(self):
+        # as regras do RSLP so sao lidas se alguma palavra nao estiver na tabela
+        if self._stemmer is None:
+            self._stemmer = nltk.stem.RSLPStemmer()
+        return self._stemmer
+
+    def stem(self, palavra):
+        radical = self.memo.get(palavra)
+        if radical is None:
+            radical = self.memo[palavra] = self.stemmer.stem(palavra)
+            self.novos += 1
+        return radical
+
+    def stem_tokens(self, tokens):
+        '''
+        Radicais de uma lista de tokens, aplicando o RSLP apenas as palavras distintas ainda nao vistas
+        '''
+        tokens = list(tokens)
+        memo = self.memo
+        for palavra in set(tokens).difference(memo):
+            memo[palavra] = self.stemmer.stem(palavra)
+            self.novos += 1
+        return [memo[token] for token in tokens]
+
+    def salvar(self, caminho=ARQUIVO_MEMO_STEMMING):
+        pasta = os.path.dirname(os.path.abspath(caminho))
+        os.makedirs(pasta, exist_ok=True)
+        temporario = caminho + '.tmp{0}'.format(os.getpid())
+        with open(temporario, 'wb') as f:
+            pickle.dump(self.memo, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporario, caminho)
+        self.novos = 0
+
+    @classmethod
+    def carregar(cls, caminho=ARQUIVO_MEMO_STEMMING):
+        '''
+        Stemmer com a tabela salva em caminho (vazia se o arquivo nao existir)
+        '''
+        if not os.path.exists(caminho):
+            return cls()
+        with open(caminho, 'rb') as f:
+            return cls(pickle.load(f))
+
+
+_stemmer_compartilhado = None
+
+
+def stemmer_compartilhado():
+    '''
+    StemmerMemoizado unico do processo, carregado de ARQUIVO_MEMO_STEMMING.
+    Palavras novas sao gravadas no arquivo ao final da execucao
+    '''
+    global _stemmer_compartilhado
+    if _stemmer_compartilhado is None:
+        _stemmer_compartilhado = StemmerMemoizado.carregar(ARQUIVO_MEMO_STEMMING)
+        atexit.register(salva_memo_stemming)
+    return _stemmer_compartilhado
+
+
+def salva_memo_stemming(caminho=ARQUIVO_MEMO_STEMMING):
+    if _stemmer_compartilhado is not None and _stemmer_compartilhado.novos > 0:
+        _stemmer_compartilhado.salvar(caminho)
+
+
+def stem_tokens(tokens):
+    '''
+    Stemming RSLP de uma lista de tokens com a tabela compartilhada
+    '''
+    return stemmer_compartilhado().stem_tokens(tokens)
+
+
 def aplica_stemming_texto(texto):
     '''
     Faz o stemming de um texto
     '''
-    stemmer = nltk.stem.RSLPStemmer()
-    return remove_acentos(' '.join(stemmer.stem(token) for token in nltk.word_tokenize(texto)))
+    return remove_acentos(' '.join(stem_tokens(nltk.word_tokenize(texto))))
 
 
 
@@ -162,63 +378,163 @@ def conta_palavras_compostas(texto_stem, expressao):
 
 
 
+DIMENSOES_ESG = ['E', 'S', 'G']
+
+RE_TERMO_TOKENS = re.compile(r'\w+(?: \w+)*')
+RE_TOKEN_STEM = re.compile(r'\w+')
+
+
+class ContadorTermosESG(object):
+    '''
+    Contador dos termos ESG compilado uma unica vez a partir das listas E/S/G (colunas do Dataframe)
+    Os termos, ja com stemming, ficam em uma trie de tokens, e cada texto e percorrido uma unica vez.
+    Mesmas contagens de conta_palavras_compostas: termo inteiro entre limites de palavra e
+    ocorrencias de um mesmo termo sem sobreposicao
+    '''
+
+    def __init__(self, termos):
+        self.trie = {}
+        self.pesos = []         # contagem de cada termo distinto em E, S e G (termos repetidos somam)
+        self.tamanhos = []      # numero de tokens de cada termo
+        self.regex = []         # (padrao, pesos) dos termos que nao sao so palavras e espacos
+        indices = {}
+        for j, dimensao in enumerate(DIMENSOES_ESG):
+            for termo in termos[dimensao]:
+                if pd.isna(termo):
+                    continue
+                expressao = aplica_stemming_texto(termo).strip().lower()
+                if expressao not in indices:
+                    indices[expressao] = self._adiciona(expressao)
+                self._peso(indices[expressao])[j] += 1
+
+    def _adiciona(self, expressao):
+        if not RE_TERMO_TOKENS.fullmatch(expressao):
+            self.regex.append((re.compile(r'\b' + expressao + r'\b'), np.zeros(3, dtype=int)))
+            return ('regex', len(self.regex) - 1)
+        tokens = expressao.split(' ')
+        no = self.trie
+        for token in tokens:
+            no = no.setdefault(token, {})
+        no[None] = len(self.pesos)
+        self.pesos.append(np.zeros(3, dtype=int))
+        self.tamanhos.append(len(tokens))
+        return ('trie', no[None])
+
+    def _peso(self, indice):
+        tipo, i = indice
+        return self.pesos[i] if tipo == 'trie' else self.regex[i][1]
+
+    def conta_stem(self, texto_stem):
+        '''
+        Contagem (E, S, G) de um texto ja preparado (sem stopwords e com stemming)
+        '''
+        palavras = [(m.group(), m.start(), m.end()) for m in RE_TOKEN_STEM.finditer(texto_stem)]
+        contagem = np.zeros(3, dtype=int)
+        fim_ultima = {}
+        for i in range(len(palavras)):
+            no = self.trie.get(palavras[i][0])
+            k = i
+            while no is not None:
+                termo = no.get(None)
+                if termo is not None and i >= fim_ultima.get(termo, 0):
+                    contagem += self.pesos[termo]
+                    fim_ultima[termo] = k + 1
+                k += 1
+                # termos compostos: proxima palavra separada por um unico espaco
+                if k >= len(palavras) or palavras[k][1] != palavras[k - 1][2] + 1 or texto_stem[palavras[k - 1][2]] != ' ':
+                    break
+                no = no.get(palavras[k][0])
+        for padrao, pesos in self.regex:
+            contagem += len(padrao.findall(texto_stem)) * pesos
+        return contagem
+
+    def conta(self, texto):
+        '''
+        Contagem (E, S, G) dos termos ESG no texto
+        '''
+        return self.conta_stem(aplica_stemming_texto(remove_palavras_texto(texto.lower(), stopwords)))
+
+
+_contadores_esg = {}
+
+
+def contador_termos_esg(termos):
+    '''
+    ContadorTermosESG das listas de termos, compilado uma unica vez por conjunto de termos
+    '''
+    chave = tuple(tuple(None if pd.isna(t) else t for t in termos[d]) for d in DIMENSOES_ESG)
+    contador = _contadores_esg.get(chave)
+    if contador is None:
+        contador = _contadores_esg[chave] = ContadorTermosESG(termos)
+    return contador
+
+
 def conta_termos_esg(texto, termos):
     '''
      Conta os termos ESG num texto. A fonte dos termos é um Dataframe
     '''
+    return tuple(int(n) for n in contador_termos_esg(termos).conta(texto))
 
-    texto_stem = aplica_stemming_texto(remove_palavras_texto(texto.lower(), stopwords))
 
-    termos['QtdeE'] = 0
-    termos['QtdeS'] = 0
-    termos['QtdeG'] = 0
+def conta_termos_esg_corpus(textos, termos=None):
+    '''
+    Matriz noticias x (QtdeE, QtdeS, QtdeG) com a contagem dos termos ESG de todos os textos
+    '''
+    if termos is None:
+        termos = le_planilha(arquivo_termos_esg)
+    contador = contador_termos_esg(termos)
+    indice = textos.index if isinstance(textos, pd.Series) else None
+    matriz = np.array([contador.conta(texto) for texto in textos], dtype=int).reshape(-1, 3)
+    return pd.DataFrame(matriz, columns=['QtdeE', 'QtdeS', 'QtdeG'], index=indice)
 
-    termos['QtdeE'] = termos['E'].apply(lambda x: conta_palavras_compostas(texto_stem, aplica_stemming_texto(x) ) if not pd.isna(x) else 0)
-    termos['QtdeS'] = termos['S'].apply(lambda x: conta_palavras_compostas(texto_stem, aplica_stemming_texto(x) ) if not pd.isna(x) else 0)
-    termos['QtdeG'] = termos['G'].apply(lambda x: conta_palavras_compostas(texto_stem, aplica_stemming_texto(x) ) if not pd.isna(x) else 0)
-    
-    r =  ( sum(termos['QtdeE']) , sum(termos['QtdeS']), sum(termos['QtdeG']) )
-    
-    return r
 
+def classifica_contagem_esg(contagem):
+    '''
+    Dimensao com mais termos em cada linha da matriz (E, S, G), ou 'Outros' sem nenhum termo
+    Empates seguem a ordem de classifica_texto: S, depois G, depois E
+    '''
+    contagem = np.asarray(contagem).reshape(-1, 3)
+    ordem = [1, 2, 0]
+    dimensoes = np.array(DIMENSOES_ESG, dtype=object)[ordem]
+    escolhida = dimensoes[np.argmax(contagem[:, ordem], axis=1)]
+    return np.where(contagem.sum(axis=1) == 0, 'Outros', escolhida).astype(object)
 
 
 def classifica_texto(texto, termos):
     '''
      Verifica a qual categoria ESG o texto mais se relaciona pela soma de contagem dos termos
     '''
-    df = pd.DataFrame({'Dimensão' : ['E', 'S', 'G'], 'Contagem': list(conta_termos_esg(texto,termos ))}).sort_values(by=['Contagem', 'Dimensão'], ascending=[False, False])
-    
-    if np.sum(df['Contagem']) == 0:
-        return 'Outros'
-    else:
-        return df.iloc[0]['Dimensão']
+    return classifica_contagem_esg(conta_termos_esg(texto, termos))[0]
     
 
-def classifica_textos_coletados(noticias, apenas_titulos=False):
+def classifica_textos_coletados(noticias, apenas_titulos=False, retorna_contagem=False):
     '''
     Classifica todas as noticias
+    Com retorna_contagem=True, retorna tambem a matriz de contagem E/S/G (conta_termos_esg_corpus)
     '''
-    dfTermos = pd.read_excel(arquivo_termos_esg)
-    
-    noticias['classificacao'] = noticias['texto_completo'].apply(lambda x : classifica_texto(x, dfTermos ) )
-    
+    dfTermos = le_planilha(arquivo_termos_esg)
+
+    contagem = conta_termos_esg_corpus(noticias['texto_completo'], dfTermos)
+    noticias['classificacao'] = classifica_contagem_esg(contagem.values)
+
+    if retorna_contagem:
+        return noticias, contagem
     return noticias
 
 
 
-def filtra_noticias_nao_relacionadas(noticias, empresa, apenas_titulos=False):
+def filtra_noticias_nao_relacionadas(noticias, empresa, apenas_titulos=False, listagem_empresas=None, registro=None):
     '''
-    Filtra notícias não relacionadas
+    Filtra notícias não relacionadas (que não citam a empresa pelo nome ou por um apelido)
+    Sem registro, usa o mesmo de filtra_citacao_relevante (registro_empresas da listagem)
     '''
 
     df = noticias
-    emp_ajustada = remove_nome_composto(remove_acentos(empresa)).lower()
+    if registro is None:
+        registro = registro_empresas(listagem_empresas)
     
-    if not apenas_titulos:
-        df = df[ df['texto_completo'].apply(lambda x : remove_acentos(x.lower())).str.contains(emp_ajustada)   ]
-    else:
-        df = df[ df['titulo'].apply(lambda x : remove_acentos(x.lower())).str.contains(emp_ajustada)   ]
+    coluna = 'titulo' if apenas_titulos else 'texto_completo'
+    df = df[ df[coluna].apply(lambda x : registro.menciona(empresa, x)).astype(bool) ]
     return df
 
 
@@ -234,83 +550,319 @@ def filtra_noticias_sem_classificacao(noticias, empresa):
 
     
 
-def conta_mencoes_empresas(noticias, empresa, listagem_empresas, arq_apelidos='datasets/apelidos_empresas.xlsx'):
+RE_PALAVRA_EMPRESA = re.compile(r'\b[a-z0-9_]+\b')
+
+arquivo_empresas = 'datasets/lista_empresas.xlsx'
+arquivo_apelidos = 'datasets/apelidos_empresas.xlsx'
+
+
+def chave_empresa(nome):
+    '''
+    Identificacao da empresa usada nas bases (nome em minusculas e sem acentos)
+    '''
+    return remove_acentos(nome.lower())
+
+
+class RegistroEmpresas(object):
+    '''
+    Registro das empresas listadas, com os nomes normalizados calculados uma unica vez.
+    Cada empresa (dicionario, pela chave) tem:
+        nome: nome original
+        chave: nome em minusculas e sem acentos (coluna 'empresa' das bases)
+        nome_curto: nome sem os termos genericos (remove_nome_composto), sem acentos
+        nome_filtro: nome curto do filtro de noticias (acentos removidos antes dos termos genericos,
+            como no filtro original: "São Martinho" -> "sao")
+        palavra: palavra que representa a empresa nos textos (nomes compostos unidos por '_', '&' vira 'e')
+        apelidos: apelidos da empresa (apelidos_empresas.xlsx)
+        padrao: expressao regular com o nome composto e os apelidos, ou None
+    Pode ser salvo e carregado (pickle)
+    '''
+
+    def __init__(self, nomes, apelidos=()):
+        '''
+        nomes: nomes das empresas (ex.: coluna Nome da listagem)
+        apelidos: pares (nome da empresa, apelido)
+        '''
+        # apelidos pela chave da empresa, listada ou nao (usados tambem por empresas avulsas)
+        self.apelidos = {}
+        for nome, apelido in apelidos:
+            if isinstance(nome, str) and isinstance(apelido, str) and apelido.strip():
+                self.apelidos.setdefault(chave_empresa(nome), []).append(apelido.strip())
+        self.empresas = {}
+        for nome in nomes:
+            if isinstance(nome, str) and nome.strip() and chave_empresa(nome) not in self.empresas:
+                self.empresas[chave_empresa(nome)] = self._nova_empresa(nome)
+        self._contadores = {}
+        self._com_avulsas = {}
+
+    @staticmethod
+    def normaliza(nome):
+        nome_curto = remove_acentos(remove_nome_composto(nome).lower())
+        return {'nome': nome, 'chave': chave_empresa(nome), 'nome_curto': nome_curto,
+                'nome_filtro': remove_nome_composto(remove_acentos(nome)).lower(),
+                'palavra': nome_curto.replace(' ', '_').replace('&', 'e'), 'apelidos': [], 'padrao': None}
+
+    @staticmethod
+    def formas(empresa):
+        '''
+        Formas da empresa no texto que sao trocadas pela sua palavra (nome composto e apelidos)
+        '''
+        formas = [empresa['nome_curto']] if empresa['nome_curto'] != empresa['palavra'] else []
+        return formas + [apelido.lower() for apelido in empresa['apelidos']]
+
+    def _nova_empresa(self, nome):
+        empresa = self.normaliza(nome)
+        empresa['apelidos'] = list(self.apelidos.get(empresa['chave'], []))
+        formas = sorted(set(self.formas(empresa)), key=len, reverse=True)
+        if formas:
+            empresa['padrao'] = re.compile(r'\b(?:' + '|'.join(map(re.escape, formas)) + r')\b', re.IGNORECASE)
+        return empresa
+
+    def __contains__(self, nome):
+        return chave_empresa(nome) in self.empresas
+
+    def __len__(self):
+        return len(self.empresas)
+
+    def empresa(self, nome):
+        '''
+        Dados normalizados da empresa (calculados na hora se ela nao estiver registrada)
+        '''
+        empresa = self.empresas.get(chave_empresa(nome))
+        if empresa is None:
+            empresa = self._nova_empresa(nome)
+        return empresa
+
+    def com_empresa(self, nome):
+        '''
+        O proprio registro, ou uma copia que inclui a empresa se ela nao estiver registrada
+        '''
+        chave = chave_empresa(nome)
+        if chave in self.empresas:
+            return self
+        registro = self._com_avulsas.get(chave)
+        if registro is None:
+            registro = RegistroEmpresas([])
+            registro.apelidos = self.apelidos
+            registro.empresas = dict(self.empresas)
+            registro.empresas[chave] = self.empresa(nome)
+            self._com_avulsas[chave] = registro
+        return registro
+
+    def menciona(self, nome, texto):
+        '''
+        Indica se o texto cita a empresa pelo nome curto do filtro ou por um apelido
+        '''
+        empresa = self.empresa(nome)
+        if empresa['nome_filtro'] in remove_acentos(texto.lower()):
+            return True
+        return empresa['padrao'] is not None and empresa['padrao'].search(texto) is not None
+
+    def contador_mencoes(self, apelidos_demais=False):
+        '''
+        ContadorMencoesEmpresas das empresas do registro (compilado uma unica vez)
+        '''
+        contador = self._contadores.get(apelidos_demais)
+        if contador is None:
+            contador = self._contadores[apelidos_demais] = ContadorMencoesEmpresas(self, apelidos_demais)
+        return contador
+
+    def __getstate__(self):
+        estado = dict(self.__dict__)
+        estado['_contadores'] = {}
+        estado['_com_avulsas'] = {}
+        return estado
+
+    def salvar(self, caminho):
+        with open(caminho, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def carregar(cls, caminho):
+        with open(caminho, 'rb') as f:
+            return pickle.load(f)
+
+    @classmethod
+    def de_listagem(cls, listagem_empresas=None, arq_apelidos=arquivo_apelidos):
+        '''
+        Registro da listagem de empresas (padrao: lista_empresas.xlsx) com os apelidos do arquivo
+        '''
+        if listagem_empresas is None:
+            listagem_empresas = le_planilha(arquivo_empresas, copia=False)
+        df_apelidos = le_planilha(arq_apelidos, copia=False)
+        return cls(listagem_empresas['Nome'], zip(df_apelidos['Nome'], df_apelidos['Apelido']))
+
+
+_registros_empresas = {}
+
+
+def registro_empresas(listagem_empresas=None, arq_apelidos=arquivo_apelidos):
+    '''
+    RegistroEmpresas da listagem, construido uma unica vez por listagem e arquivo de apelidos
+    (padrao: lista_empresas.xlsx)
+    '''
+    if listagem_empresas is None:
+        chave = (arquivo_empresas, os.path.getmtime(arquivo_empresas), arq_apelidos, os.path.getmtime(arq_apelidos))
+    else:
+        chave = (tuple(listagem_empresas['Nome']), arq_apelidos, os.path.getmtime(arq_apelidos))
+    registro = _registros_empresas.get(chave)
+    if registro is None:
+        registro = _registros_empresas[chave] = RegistroEmpresas.de_listagem(listagem_empresas, arq_apelidos)
+    return registro
+
+
+class ContadorMencoesEmpresas(object):
+    '''
+    Contagem das citacoes de todas as empresas do registro em uma unica passada por texto:
+    cada palavra do texto e procurada no dicionario palavra -> coluna.
+    O resultado e uma matriz esparsa noticias x palavras das empresas (empresas com a
+    mesma palavra, como AES Brasil e AES Tiete, compartilham a coluna).
+    Como em conta_mencoes_empresas, o nome composto, o nome com '&' e os apelidos contam
+    apenas para a propria empresa (citacoes), e as demais empresas so pela sua palavra;
+    essas linhas sao recontadas por empresa em citacoes().
+    Com apelidos_demais=True, as formas de todas as empresas ficam em uma unica expressao
+    regular aplicada antes da contagem, e passam a contar tambem como citacao de outra empresa
+    '''
+
+    def __init__(self, registro, apelidos_demais=False):
+        self.apelidos_demais = apelidos_demais
+        self.palavras = []
+        self.colunas = {}       # palavra -> coluna
+        self.empresas = {}      # chave da empresa -> coluna
+        self.padroes = {}       # chave da empresa -> (expressao das suas formas, palavra)
+        substituicoes = {}      # forma no texto (minusculas) -> palavra
+        for chave, empresa in registro.empresas.items():
+            self.empresas[chave] = self._coluna(empresa['palavra'])
+            if empresa['padrao'] is not None:
+                self.padroes[chave] = (empresa['padrao'], empresa['palavra'])
+        for empresa in registro.empresas.values() if apelidos_demais else ():
+            for forma in registro.formas(empresa):
+                # apelido que e o nome de outra empresa (ex.: dexco/duratex) nao a apaga do texto
+                if forma not in self.colunas:
+                    substituicoes[forma] = empresa['palavra']
+        self.substituicoes = substituicoes
+        formas = sorted(substituicoes, key=len, reverse=True)
+        self.padrao = re.compile(r'\b(?:' + '|'.join(map(re.escape, formas)) + r')\b', re.IGNORECASE) if formas else None
+        self.comuns = np.array([p in TERMOS_COMUNS_EMPRESAS for p in self.palavras], dtype=bool)
+
+    def _coluna(self, palavra):
+        coluna = self.colunas.get(palavra)
+        if coluna is None:
+            coluna = self.colunas[palavra] = len(self.palavras)
+            self.palavras.append(palavra)
+        return coluna
+
+    def coluna(self, empresa):
+        '''
+        Coluna da empresa na matriz (pela chave), None se nao registrada
+        '''
+        return self.empresas.get(chave_empresa(empresa))
+
+    def _substitui(self, m):
+        return self.substituicoes.get(m.group().lower(), m.group())
+
+    def _contagem(self, texto, padrao=None, substituicao=None):
+        if padrao is not None:
+            texto = padrao.sub(substituicao, texto)
+        return Counter(p for p in RE_PALAVRA_EMPRESA.findall(remove_acentos(texto.lower())) if p in self.colunas)
+
+    def conta(self, textos):
+        '''
+        Matriz esparsa (csr) noticias x palavras das empresas com o numero de citacoes
+        '''
+        textos = list(textos)
+        linhas, colunas, valores = [], [], []
+        for i, texto in enumerate(textos):
+            if not isinstance(texto, str):
+                continue
+            for palavra, n in self._contagem(texto, self.padrao, self._substitui).items():
+                linhas.append(i)
+                colunas.append(self.colunas[palavra])
+                valores.append(n)
+        return sp.csr_matrix((valores, (linhas, colunas)), shape=(len(textos), len(self.palavras)), dtype=int)
+
+    def matriz_empresa(self, textos, empresa, matriz):
+        '''
+        Matriz com as noticias que citam a empresa pelo nome composto ou por apelido recontadas
+        com essas formas trocadas pela sua palavra (sem alteracao com apelidos_demais=True)
+        '''
+        padrao = self.padroes.get(chave_empresa(empresa))
+        if self.apelidos_demais or padrao is None:
+            return matriz
+        padrao, palavra = padrao
+        textos = list(textos)
+        linhas = [i for i, texto in enumerate(textos) if isinstance(texto, str) and padrao.search(texto)]
+        if not linhas:
+            return matriz
+        matriz = matriz.tolil(copy=True)
+        for i in linhas:
+            matriz[i, :] = 0
+            for p, n in self._contagem(textos[i], padrao, lambda m: palavra).items():
+                matriz[i, self.colunas[p]] = n
+        return matriz.tocsr()
+
+    def demais_citacoes(self, matriz):
+        '''
+        Total de citacoes de empresas por noticia, sem os nomes que sao palavras comuns
+        '''
+        return np.asarray(matriz[:, np.flatnonzero(~self.comuns)].sum(axis=1)).ravel()
+
+    def citacoes(self, matriz, empresa, textos=None):
+        '''
+        Citacoes da empresa e das demais empresas em cada noticia
+        textos: textos da matriz, para recontar as citacoes por nome composto ou apelido da empresa
+        '''
+        if textos is not None:
+            matriz = self.matriz_empresa(textos, empresa, matriz)
+        coluna = self.coluna(empresa)
+        total = self.demais_citacoes(matriz)
+        if coluna is None:
+            return np.zeros(matriz.shape[0], dtype=int), total
+        proprias = np.asarray(matriz[:, coluna].todense()).ravel()
+        return proprias, total - (0 if self.comuns[coluna] else proprias)
+
+
+def mencoes_empresas(noticias, listagem_empresas=None, arq_apelidos=arquivo_apelidos, registro=None, apelidos_demais=False):
+    '''
+    Citacoes de todas as empresas em todas as noticias: matriz esparsa noticias x palavras
+    das empresas e o contador (contador.palavras nomeia as colunas).
+    Sem apelidos_demais, a matriz conta apenas as palavras das empresas
+    '''
+    if registro is None:
+        registro = registro_empresas(listagem_empresas, arq_apelidos)
+    contador = registro.contador_mencoes(apelidos_demais)
+    return contador.conta(noticias['texto_completo']), contador
+
+
+def conta_mencoes_empresas(noticias, empresa, listagem_empresas, arq_apelidos=arquivo_apelidos, registro=None, apelidos_demais=False):
     '''
      Conta a quatidade de empresas citadas em cada noticia (empresa selecionada x demais)
      importante para nao considerar noticias que falam de muitas empresas
-    '''
-
-    df2 = noticias
-    df = noticias
-    
-    emp_ajustada = remove_acentos(remove_nome_composto(empresa.lower()))
-    empresas_ajust = list(listagem_empresas['Nome'])
-    empresas_ajust = remove_termos_comuns(list(set([remove_acentos(remove_nome_composto(i).lower()) for i in empresas_ajust])))
-
-    df2['texto_completo_orig'] = df2['texto_completo']
-    
-    # trata empresas com espaços no nome
-    if ' ' in emp_ajustada:
-        df2['texto_completo'] = df2['texto_completo'].apply(lambda x : re.sub(emp_ajustada,emp_ajustada.replace(' ', '_') , x, flags=re.IGNORECASE))   
-        emp_ajustada = emp_ajustada.replace(' ', '_') 
-        
-    # trata empresas com & no nome
-    if '&' in emp_ajustada:
-        df2['texto_completo'] = df2['texto_completo'].apply(lambda x : re.sub(emp_ajustada,emp_ajustada.replace('&', 'e') , x, flags=re.IGNORECASE))   
-        emp_ajustada = emp_ajustada.replace('&', 'e') 
-    
-    if emp_ajustada not in empresas_ajust:
-        empresas_ajust.append(emp_ajustada)
-        
-    # trata empresas com apelidos
-    df_apelidos = pd.read_excel(arq_apelidos)
-    df_apelidos = df_apelidos[df_apelidos['Nome'] == empresa]
-    for i, r in df_apelidos.iterrows():
-        df2['texto_completo'] = df2['texto_completo'].apply(lambda x : re.sub(r"\b" + r['Apelido'] +  r"\b", emp_ajustada , x, flags=re.IGNORECASE))
-
-    wordlist = list(map(str.lower, empresas_ajust))
-    wordlist = list(set(wordlist))
-    
-    
-    counters = df2['texto_completo'].apply(lambda t : Counter(re.findall(r'\b[a-z0-9_]+\b', remove_palavras_texto(remove_acentos(t.lower()), list(noticias.columns)))))
-    
-    df2 = pd.concat([df2, counters.apply(pd.Series).fillna(0).astype(int)], axis=1)
-    
-    # remove palavras que nao sao empresas
-    other_words = list(set(df2.columns) - set(wordlist) - set(noticias.columns))
-    df2 = df2.drop(other_words, axis=1)
-
-    demais_empresas = list( set(wordlist).intersection(df2.columns))
-    
-    if emp_ajustada in demais_empresas:
-        demais_empresas.remove(emp_ajustada)
-
-    df2['demais_citacoes'] = df2[demais_empresas].sum(axis=1)
-
-    df2 = df2.drop(demais_empresas, axis=1)
-
-    if 'citacoes_empresa' in df2.columns and emp_ajustada in df2.columns:
-        df2['citacoes_empresa'] = df2[emp_ajustada]
-        del df2[emp_ajustada]
-    else:
-        df2.rename(columns = {emp_ajustada:'citacoes_empresa'}, inplace = True)
-    
-    del df2['texto_completo']
-    
-    df2.rename(columns = {'texto_completo_orig':'texto_completo'}, inplace = True)
-    
+     apelidos_demais=True conta tambem nomes compostos e apelidos das demais empresas
+    '''
+    if registro is None:
+        registro = registro_empresas(listagem_empresas, arq_apelidos)
+    contador = registro.com_empresa(empresa).contador_mencoes(apelidos_demais)
+    textos = list(noticias['texto_completo'])
+    matriz = contador.conta(textos)
+    citacoes, demais = contador.citacoes(matriz, empresa, textos)
+
+    df2 = noticias.copy()
+    df2['texto_completo'] = df2.pop('texto_completo')
+    df2['citacoes_empresa'] = citacoes
+    df2['demais_citacoes'] = demais
     return df2
 
 
 
 
-def filtra_citacao_relevante(noticias, empresa, listagem_empresas, threshold=1.0, aceitar_titulo=True, recalcular_contagem=True):
+def filtra_citacao_relevante(noticias, empresa, listagem_empresas, threshold=1.0, aceitar_titulo=True, recalcular_contagem=True, registro=None, apelidos_demais=False):
     '''
     Verifica se a citação a empresa é relevante (> soma das demais ou aparecer no titulo)
     '''
     df2 = noticias
     if recalcular_contagem:    
-        df2 = conta_mencoes_empresas(noticias, empresa, listagem_empresas)
+        df2 = conta_mencoes_empresas(noticias, empresa, listagem_empresas, registro=registro, apelidos_demais=apelidos_demais)
         
     if aceitar_titulo:
         df2['relevante'] = df2.apply(lambda row : 
@@ -325,6 +877,48 @@ def filtra_citacao_relevante(noticias, empresa, listagem_empresas, threshold=1.0
     return df2[ df2['relevante'] == 1 ]
 
 
+def relevancia_citacoes_empresas(noticias, listagem_empresas=None, threshold=1.0, aceitar_titulo=True, arq_apelidos=arquivo_apelidos, registro=None, apelidos_demais=False):
+    '''
+    Criterio de filtra_citacao_relevante avaliado para todas as empresas da listagem de uma vez.
+    Retorna um DataFrame esparso noticias x empresas (chave_empresa) com 1 onde a citacao e relevante
+    '''
+    matriz, contador = mencoes_empresas(noticias, listagem_empresas, arq_apelidos, registro, apelidos_demais)
+    demais = contador.demais_citacoes(matriz)
+
+    # so as noticias que citam a empresa podem ter citacoes > threshold * demais
+    coo = matriz.tocoo()
+    demais_sem_propria = demais[coo.row] - np.where(contador.comuns[coo.col], 0, coo.data)
+    relevantes = coo.data > threshold * demais_sem_propria
+    linhas_coluna = {}
+    for linha, coluna in zip(coo.row[relevantes], coo.col[relevantes]):
+        linhas_coluna.setdefault(coluna, set()).add(linha)
+
+    empresas = list(contador.empresas)
+    if aceitar_titulo:
+        titulos = [chave_empresa(t) if isinstance(t, str) else '' for t in noticias['titulo']]
+
+    # empresas com nome composto ou apelido: citacoes recontadas com as suas formas
+    textos = list(noticias['texto_completo'])
+    recontadas = {}
+    if not apelidos_demais:
+        for empresa in contador.padroes:
+            citacoes, demais_empresa = contador.citacoes(matriz, empresa, textos)
+            recontadas[empresa] = set(np.flatnonzero(citacoes > threshold * demais_empresa))
+
+    linhas, colunas = [], []
+    for j, empresa in enumerate(empresas):
+        if empresa in recontadas:
+            selecionadas = recontadas[empresa]
+        else:
+            selecionadas = set(linhas_coluna.get(contador.empresas[empresa], ()))
+        if aceitar_titulo:
+            selecionadas.update(i for i, titulo in enumerate(titulos) if empresa in titulo)
+        linhas.extend(selecionadas)
+        colunas.extend([j] * len(selecionadas))
+    relevancia = sp.csr_matrix((np.ones(len(linhas), dtype=int), (linhas, colunas)), shape=(len(noticias), len(empresas)))
+    return pd.DataFrame.sparse.from_spmatrix(relevancia, index=noticias.index, columns=empresas)
+
+
 def trata_nome_fontes(fonte):
     fonte  = fonte.lower()
     fonte = fonte.replace('istoé dinheiro', 'istoé')
@@ -0,0 +1,172 @@
+'''
+Módulo de linha de comando para pontuar grandes volumes de notícias fora das notebooks
+Lê NDJSON ou CSV (arquivo ou stdin) em blocos de tamanho fixo, processa os blocos em paralelo
+e escreve os resultados na ordem de entrada, com memória constante
+
+Exemplo:
+    python pontuador_noticias.py noticias.ndjson -o resultado.ndjson --workers 4
+    cat noticias.csv | python pontuador_noticias.py - --formato csv --sem-titulo > resultado.csv
+
+Projeto Análise de sentimentos sobre notícias do tema ESG
+Trabalho de conclusão de curso - MBA Digital Business USP Esalq
+'''
+
+import argparse
+import os
+import sys
+import pickle
+from collections import deque
+from multiprocessing import Pool
+import pandas as pd
+from analise_sentimento_modelo import polaridade_sentimento_vaderptbr
+from classificador_esg import aplica_classificador_esg
+from indice_boilerplate import IndiceBoilerplate
+
+
+# configuracao de cada processo (definida no inicializador)
+_config = None
+_classificador = None
+_boilerplate = None
+
+
+def _inicializa_processo(config):
+    '''
+    Carrega uma unica vez por processo o classificador ESG (se informado) e o analisador
+    '''
+    global _config, _classificador, _boilerplate
+    _config = config
+    if config['boilerplate']:
+        _boilerplate = IndiceBoilerplate.carregar(config['boilerplate'])
+    if config['vect'] and config['modelo']:
+        with open(config['vect'], 'rb') as f_vect, open(config['modelo'], 'rb') as f_modelo:
+            _classificador = (pickle.load(f_vect), pickle.load(f_modelo))
+    polaridade_sentimento_vaderptbr('', None, resumir=False)
+
+
+def processa_bloco(df):
+    '''
+    Polaridade (e classificacao ESG, se houver classificador) de cada noticia do bloco
+    '''
+    col_texto = _config['col_texto']
+    col_titulo = _config['col_titulo']
+    resumir = _config['resumir']
+
+    if _boilerplate is not None:
+        # linhas repetidas da fonte saem antes de qualquer processamento
+        df[col_texto] = _boilerplate.limpa_noticias(df, _config['col_fonte'], col_texto)
+
+    polaridades = []
+    for i, noticia in df.iterrows():
+        texto = noticia[col_texto]
+        if pd.isnull(texto):
+            polaridades.append(None)
+            continue
+        titulo = noticia.get(col_titulo) if col_titulo else None
+        if titulo is not None and pd.isnull(titulo):
+            titulo = None
+        polaridades.append(polaridade_sentimento_vaderptbr(str(texto), titulo if titulo is None else str(titulo), resumir))
+    df['polaridade'] = polaridades
+
+    if _classificador is not None:
+        validos = df[~pd.isnull(df[col_texto])].copy()
+        validos[col_texto] = validos[col_texto].astype(str)
+        df['classificacao'] = None
+        if len(validos):
+            vect, model = _classificador
+            df.loc[validos.index, 'classificacao'] = aplica_classificador_esg(vect, model, validos,
+                                     comparar_com_real=False, col_texto_origem=col_texto,
+                                     col_texto_saida='texto_ajustado')
+    return df
+
+
+def le_blocos(entrada, formato, tamanho_bloco):
+    '''
+    Gera os blocos (DataFrames) da entrada sem carrega-la inteira na memoria
+    '''
+    if formato == 'csv':
+        leitor = pd.read_csv(entrada, chunksize=tamanho_bloco)
+    else:
+        leitor = pd.read_json(entrada, lines=True, chunksize=tamanho_bloco, dtype=False)
+    with leitor:
+        for bloco in leitor:
+            yield bloco
+
+
+def escreve_bloco(df, saida, formato, primeiro):
+    if formato == 'csv':
+        df.to_csv(saida, header=primeiro, index=False)
+    else:
+        texto = df.to_json(orient='records', lines=True, force_ascii=False)
+        saida.write(texto if texto.endswith('\n') else texto + '\n')
+    saida.flush()
+
+
+def processa_fluxo(blocos, config, workers=1):
+    '''
+    Processa os blocos em paralelo e os devolve na ordem de entrada.
+    No maximo 2 blocos por processo ficam pendentes, o que limita a memoria usada
+    '''
+    if workers <= 1:
+        _inicializa_processo(config)
+        for bloco in blocos:
+            yield processa_bloco(bloco)
+        return
+
+    with Pool(workers, initializer=_inicializa_processo, initargs=(config,)) as pool:
+        pendentes = deque()
+        for bloco in blocos:
+            pendentes.append(pool.apply_async(processa_bloco, (bloco,)))
+            if len(pendentes) >= 2 * workers:
+                yield pendentes.popleft().get()
+        while pendentes:
+            yield pendentes.popleft().get()
+
+
+def detecta_formato(caminho):
+    return 'csv' if caminho.lower().endswith('.csv') else 'ndjson'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pontua o sentimento (e a dimensao ESG) de noticias em NDJSON ou CSV')
+    parser.add_argument('entrada', nargs='?', default='-', help="arquivo de entrada ou '-' para stdin")
+    parser.add_argument('-o', '--saida', default='-', help="arquivo de saida ou '-' para stdout")
+    parser.add_argument('--formato', choices=['ndjson', 'csv'], help='formato da entrada (padrao: pela extensao, senao ndjson)')
+    parser.add_argument('--formato-saida', choices=['ndjson', 'csv'], help='formato da saida (padrao: o da entrada)')
+    parser.add_argument('--col-texto', default='texto_completo')
+    parser.add_argument('--col-titulo', default='titulo')
+    parser.add_argument('--sem-titulo', action='store_true', help='nao pondera a polaridade com o titulo')
+    parser.add_argument('--sem-resumo', action='store_true', help='pontua o texto completo, sem o sumario TextRank')
+    parser.add_argument('--classificador-vect', help='vetorizador do classificador ESG (pickle)')
+    parser.add_argument('--classificador-modelo', help='modelo do classificador ESG (pickle)')
+    parser.add_argument('--indice-boilerplate', help='indice de linhas repetidas por fonte (IndiceBoilerplate.salvar)')
+    parser.add_argument('--col-fonte', default='fonte')
+    parser.add_argument('--tamanho-bloco', type=int, default=500, help='noticias por bloco')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processos em paralelo')
+    args = parser.parse_args(argv)
+
+    if bool(args.classificador_vect) != bool(args.classificador_modelo):
+        parser.error('informe --classificador-vect e --classificador-modelo juntos')
+
+    formato = args.formato or (detecta_formato(args.entrada) if args.entrada != '-' else 'ndjson')
+    formato_saida = args.formato_saida or formato
+    config = {'col_texto': args.col_texto,
+              'col_titulo': None if args.sem_titulo else args.col_titulo,
+              'resumir': not args.sem_resumo,
+              'vect': args.classificador_vect,
+              'modelo': args.classificador_modelo,
+              'boilerplate': args.indice_boilerplate,
+              'col_fonte': args.col_fonte}
+
+    entrada = sys.stdin if args.entrada == '-' else args.entrada
+    saida = sys.stdout if args.saida == '-' else open(args.saida, 'w', encoding='utf-8', newline='')
+    try:
+        blocos = le_blocos(entrada, formato, args.tamanho_bloco)
+        for i, df in enumerate(processa_fluxo(blocos, config, args.workers)):
+            escreve_bloco(df, saida, formato_saida, i == 0)
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Módulo do segmentador de sentenças e parágrafos em português, em uma única passada (tempo linear)
+Substitui as expressões regulares com quantificadores preguiçosos, que fazem backtracking em
+parágrafos longos sem pontuação, e não quebra a sentença em abreviaturas como "Sr." e "S.A."
+Retorna as posições (início, fim) das sentenças no texto, e não cópias
+Usado pelo sumarizador TextRank e pelo VADER (janela do "mas/porém" limitada à sentença)
+Projeto Análise de sentimentos sobre notícias do tema ESG
+Trabalho de conclusão de curso - MBA Digital Business USP Esalq
+'''
+
+import re
+
+# pontuacao final seguida de espaco (ou fim do texto)
+RE_FIM_SENTENCA = re.compile(r'[.!?](?=\s|$)')
+RE_NAO_ESPACO = re.compile(r'\S')
+
+# abreviaturas que nunca terminam a sentenca (pronomes de tratamento, titulos e afins)
+# so valem em minusculas ou com a inicial maiuscula ("Sr.", "gov."): em maiusculas ("GOV.", "CAP.") sao siglas
+ABREVIATURAS = frozenset(['sr', 'sra', 'srs', 'sras', 'srta', 'dr', 'dra', 'drs', 'dras', 'prof', 'profa', 'profs',
+                          'eng', 'enga', 'arq', 'adv', 'exmo', 'exma', 'ilmo', 'ilma', 'mr', 'mrs', 'sto', 'sta',
+                          'fr', 'gen', 'cel', 'ten', 'maj', 'cap', 'sgt', 'dep', 'sen', 'gov', 'pres', 'vol',
+                          'art', 'arts', 'fl', 'fls', 'pag', 'pags', 'p', 'pp', 'tel', 'av', 'nº',
+                          'aprox', 'obs', 'ex', 'ref', 'jr', 'ed', 'vs', 'ca'])
+
+# abreviaturas que podem terminar a sentenca: so quebra se a proxima palavra comeca com maiuscula
+ABREVIATURAS_FINAIS = frozenset(['ltda', 'cia', 'co', 'corp', 'inc', 'etc'])
+
+RE_SIGLA = re.compile(r'(?:\w\.){2,}$')
+RE_INICIAL = re.compile(r'[A-Z]\.$')
+RE_PALAVRA = re.compile(r'[ \t\r\f\v]*(\S+)')
+
+
+def _abreviatura(text, fim):
+    '''
+    Indica se o ponto em text[fim] encerra uma abreviatura e nao a sentenca
+    '''
+    inicio = fim
+    while inicio > 0 and not text[inicio - 1].isspace():
+        inicio -= 1
+    palavra = text[inicio:fim + 1].lstrip('(["\'“')
+    if RE_INICIAL.match(palavra):
+        return True
+    raiz = palavra[:-1]
+    if raiz.lower() in ABREVIATURAS and raiz in (raiz.lower(), raiz.capitalize()):
+        return True
+    if raiz.lower() in ABREVIATURAS_FINAIS or RE_SIGLA.match(palavra):
+        m = RE_PALAVRA.match(text, fim + 1)
+        if m is None:
+            return False
+        proxima = m.group(1)
+        # continua se a proxima palavra comeca com minuscula ou e outro sufixo (ex.: "Cia. Ltda.")
+        return not proxima[0].isupper() or proxima.rstrip('.,;:').lower() in ABREVIATURAS_FINAIS
+    return False
+
+
+def segmenta_sentencas(text, abreviaturas=True, inicio=0, fim=None):
+    '''
+    Posicoes (inicio, fim) das sentencas de text[inicio:fim], em uma unica passada.
+    Mesma regra de RE_SENTENCE do sumarizador: a sentenca vai ate o primeiro . ! ou ?
+    seguido de espaco, ou ate o fim da linha; com abreviaturas=True, o ponto de uma
+    abreviatura conhecida nao encerra a sentenca
+    '''
+    fim = len(text) if fim is None else fim
+    finais = RE_FIM_SENTENCA.finditer(text, inicio, fim)
+    proximo_final = next(finais, None)
+    p = inicio
+    fim_linha = -1
+    while True:
+        m = RE_NAO_ESPACO.search(text, p, fim)
+        if m is None:
+            return
+        s = m.start()
+        # fim da linha procurado uma unica vez por linha (e nao por sentenca)
+        if s >= fim_linha:
+            fim_linha = text.find('\n', s, fim)
+            if fim_linha < 0:
+                fim_linha = fim
+
+        # primeira pontuacao final valida da linha a partir de s+2
+        while proximo_final is not None and (proximo_final.start() < s + 2 or
+                                             (abreviaturas and text[proximo_final.start()] == '.' and
+                                              proximo_final.start() < fim_linha and
+                                              _abreviatura(text, proximo_final.start()))):
+            proximo_final = next(finais, None)
+
+        if proximo_final is not None and proximo_final.start() < fim_linha:
+            e = proximo_final.end()
+        elif fim_linha - s >= 2:
+            e = fim_linha
+        else:
+            # linha de um unico caractere: ignorada (como no RE_SENTENCE)
+            p = s + 1
+            continue
+        yield s, e
+        p = e
+
+
+def segmenta_paragrafos(text):
+    '''
+    Posicoes (inicio, fim) dos paragrafos: trechos separados por linha em branco,
+    incluindo a quebra de linha final (mesma regra de RE_PARAGRAPH)
+    '''
+    p = 0
+    n = len(text)
+    while p < n:
+        while p < n and text[p] == '\n':
+            p += 1
+        if p >= n:
+            return
+        quebra = text.find('\n\n', p)
+        e = n if quebra < 0 else quebra + 1
+        yield p, e
+        p = e
@@ -0,0 +1,168 @@
+'''
+Módulo do serviço de pontuação de sentimento sob demanda (usado pela API do app.py)
+Pedidos concorrentes são agrupados em micro-lotes pontuados por um único analisador
+VADER já carregado, com sumarização TextRank opcional
+Projeto Análise de sentimentos sobre notícias do tema ESG
+Trabalho de conclusão de curso - MBA Digital Business USP Esalq
+'''
+
+import threading
+import queue
+import time
+from collections import deque
+import numpy as np
+from vaderSentimentptbr import shared_analyzer
+from sumarizador_textrankptbr import summarize_text_rank
+
+
+class PedidoSentimento(object):
+    '''
+    Pedido de pontuação de um ou mais textos, aguardando o seu micro-lote
+    '''
+
+    def __init__(self, textos, resumir):
+        self.textos = textos
+        self.resumir = resumir
+        self.inicio = time.perf_counter()
+        self.resultado = None
+        self.erro = None
+        self.pronto = threading.Event()
+
+
+class LoteadorSentimento(object):
+    '''
+    Agrupa pedidos concorrentes em micro-lotes: o primeiro pedido espera no maximo
+    espera_max segundos por outros, até max_textos textos por lote.
+    Os lotes sao pontuados em uma thread propria, sempre pelo mesmo analisador
+    '''
+
+    def __init__(self, max_textos=64, espera_max=0.005, janela_metricas=1000):
+        self.max_textos = max_textos
+        self.espera_max = espera_max
+        self.fila = queue.Queue()
+        self.trava = threading.Lock()
+        self.thread = None
+
+        # metricas
+        self.latencias = deque(maxlen=janela_metricas)
+        self.tamanhos_lote = deque(maxlen=janela_metricas)
+        self.total_pedidos = 0
+        self.total_textos = 0
+        self.total_lotes = 0
+        self.total_erros = 0
+
+    def inicia(self):
+        '''
+        Carrega o analisador e inicia a thread dos lotes (se ainda nao iniciada)
+        '''
+        with self.trava:
+            if self.thread is None:
+                shared_analyzer()
+                self.thread = threading.Thread(target=self._executa, name='loteador-sentimento', daemon=True)
+                self.thread.start()
+
+    def pontua(self, textos, resumir=True, timeout=30):
+        '''
+        Pontua os textos (lista de str), retornando para cada um compound, neg, neu e pos
+        '''
+        self.inicia()
+        pedido = PedidoSentimento(textos, resumir)
+        self.fila.put(pedido)
+        if not pedido.pronto.wait(timeout):
+            raise TimeoutError('tempo esgotado aguardando a pontuacao')
+        if pedido.erro is not None:
+            raise pedido.erro
+        return pedido.resultado
+
+    def _proximo_lote(self):
+        pedidos = [self.fila.get()]
+        n_textos = len(pedidos[0].textos)
+        limite = time.perf_counter() + self.espera_max
+        while n_textos < self.max_textos:
+            restante = limite - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                pedido = self.fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            pedidos.append(pedido)
+            n_textos += len(pedido.textos)
+        return pedidos, n_textos
+
+    def _executa(self):
+        s = shared_analyzer()
+        while True:
+            pedidos, n_textos = self._proximo_lote()
+            pontua_lote(s, pedidos)
+            for pedido in pedidos:
+                pedido.pronto.set()
+
+            fim = time.perf_counter()
+            with self.trava:
+                self.total_lotes += 1
+                self.total_textos += n_textos
+                self.tamanhos_lote.append(n_textos)
+                for pedido in pedidos:
+                    self.total_pedidos += 1
+                    self.total_erros += pedido.erro is not None
+                    self.latencias.append(fim - pedido.inicio)
+
+    def metricas(self):
+        '''
+        Contadores e estatisticas de latencia (ms) e tamanho de lote dos ultimos pedidos
+        '''
+        with self.trava:
+            latencias = np.array(self.latencias, dtype=float) * 1000
+            tamanhos = np.array(self.tamanhos_lote, dtype=float)
+            metricas = {'pedidos': self.total_pedidos, 'textos': self.total_textos,
+                        'lotes': self.total_lotes, 'erros': self.total_erros,
+                        'fila': self.fila.qsize()}
+        if len(latencias):
+            metricas['latencia_ms'] = {'media': float(latencias.mean()),
+                                       'p50': float(np.percentile(latencias, 50)),
+                                       'p95': float(np.percentile(latencias, 95)),
+                                       'p99': float(np.percentile(latencias, 99)),
+                                       'max': float(latencias.max())}
+        if len(tamanhos):
+            metricas['tamanho_lote'] = {'media': float(tamanhos.mean()),
+                                        'max': int(tamanhos.max())}
+        return metricas
+
+
+def prepara_texto(texto, resumir=True):
+    '''
+    Texto pontuado pelo mesmo pipeline do modelo: sumario TextRank (opcional)
+    '''
+    if resumir:
+        texto = summarize_text_rank(texto, compression=0.8, include_first_parag=True)
+    return texto
+
+
+def pontua_lote(s, pedidos):
+    '''
+    Pontua todos os textos de um micro-lote em uma unica chamada ao polarity_scores_batch,
+    preenchendo o resultado (compound, neg, neu e pos de cada texto) ou o erro de cada pedido
+    '''
+    validos, textos = [], []
+    for pedido in pedidos:
+        try:
+            preparados = [prepara_texto(texto, pedido.resumir) for texto in pedido.textos]
+        except Exception as e:
+            pedido.erro = e
+            continue
+        validos.append(pedido)
+        textos.extend(preparados)
+
+    try:
+        # no proprio processo: o lote ja e pequeno e o analisador compartilhado tem os caches
+        tabela = s.polarity_scores_batch(textos, n_jobs=1)
+    except Exception as e:
+        for pedido in validos:
+            pedido.erro = e
+        return
+
+    linhas = iter(tabela[['compound', 'neg', 'neu', 'pos']].itertuples(index=False))
+    for pedido in validos:
+        pedido.resultado = [{'compound': float(compound), 'neg': float(neg), 'neu': float(neu), 'pos': float(pos)}
+                            for _, (compound, neg, neu, pos) in zip(pedido.textos, linhas)]
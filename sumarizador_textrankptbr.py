@@ -13,82 +13,351 @@ Trabalho de conclusão de curso - MBA Digital Business USP Esalq'
 
 
 from summa import summarizer
+from summa.preprocessing import textcleaner
+from functools import lru_cache
+from math import log10
+from scipy import sparse
+from multiprocessing import Pool
+from bisect import bisect_left, bisect_right
+import os
 import pandas as pd
 import re
 import numpy as np
+from cache_disco import cache_compartilhado, chave_conteudo
+from segmentador_sentencas import segmenta_sentencas, segmenta_paragrafos
 
 RE_SENTENCE = re.compile('(\S.+?[.!?])(?=\s+|$)|(\S.+?)(?=[\n]|$)')
 RE_PARAGRAPH = re.compile(r'(?s)((?:[^\n][\n]?)+)')
 RE_WORDS = re.compile(r'\w+')
 
+# motor TextRank usado por padrao: 'summa' (biblioteca original) ou 'nativo' (matriz esparsa)
+TEXTRANK_BACKEND = 'summa'
+
+# cache em disco dos sumarios (summarize_many); a versao entra na chave
+CACHE_SUMARIOS = 'datasets/.cache/sumarios.sqlite'
+VERSAO_SUMARIO = 4
+
 
 def get_sentences(text):
-    for match in RE_SENTENCE.finditer(text):
-        yield match.group()
+    for inicio, fim in segmenta_sentencas(text):
+        yield text[inicio:fim]
         
 def get_paragraphs(text):
-    for match in RE_PARAGRAPH.finditer(text):
-        yield match.group()
+    for inicio, fim in segmenta_paragrafos(text):
+        yield text[inicio:fim]
         
-def split_text_to_pandas(text):
-    linha = 0
-    paragrafo = 0
-    df = pd.DataFrame(columns=['P#', 'S#', 'W#', 'Sentenca'])
-    for p in get_paragraphs(text):
+def divide_sentencas(text):
+    '''
+    Divide o texto em sentencas, retornando as listas de sentencas, paragrafo (P#),
+    linha (S#) e numero de palavras (W#) de cada uma
+    '''
+    sentencas = []
+    paragrafos = []
+    linhas = []
+    palavras = []
+    for paragrafo, p in enumerate(get_paragraphs(text)):
         for s in get_sentences(p):
-            words = len(re.findall(RE_WORDS, s))
-            df = pd.concat([df, pd.DataFrame({'P#': [paragrafo], 'S#' : [linha], 'W#' : [words], 'Sentenca': [s]})], ignore_index=True )
-            linha = linha+1
-        paragrafo = paragrafo+1
-    return df
-        
+            paragrafos.append(paragrafo)
+            linhas.append(len(sentencas))
+            palavras.append(len(RE_WORDS.findall(s)))
+            sentencas.append(s)
+    return sentencas, paragrafos, linhas, palavras
 
 
-def summarize_text_rank(text, compression=0.8, include_first_parag=True):
+def split_text_to_pandas(text):
+    sentencas, paragrafos, linhas, palavras = divide_sentencas(text)
+    return pd.DataFrame({'P#': paragrafos, 'S#': linhas, 'W#': palavras, 'Sentenca': sentencas},
+                        columns=['P#', 'S#', 'W#', 'Sentenca'])
+
+
+# #TextRank nativo# #
+
+@lru_cache(maxsize=100000)
+def _stem_ptbr(palavra):
+    return textcleaner.STEMMER.stem(palavra)
+
+
+def _filtra_sentenca(sentenca):
     '''
-    Sumariza o texto
+    Mesmos filtros do summa (minusculas, numeros, pontuacao, stopwords e stemming),
+    com o stemming memoizado por palavra
     '''
-    dfTexto = split_text_to_pandas(text)
-    
-    if len(text) < 30 or len(dfTexto) < 7:
-        return text
-    else:
+    sentenca = textcleaner.strip_punctuation(textcleaner.strip_numeric(sentenca.lower()))
+    return ' '.join(_stem_ptbr(w) for w in sentenca.split() if w not in textcleaner.STOPWORDS)
+
+
+def textrank_scores(text, damping=0.85, tol=1e-12, max_iter=1000):
+    '''
+    Score TextRank de cada sentenca do texto (lista de pares sentenca, score na ordem do texto),
+    equivalente a summarizer.summarize(text, language='portuguese', scores=True, ratio=1.1).
+    A similaridade entre sentencas vem de uma matriz esparsa sentenca x termo (conjuntos de ids
+    dos termos) e o PageRank e calculado por iteracao de potencia ate a tolerancia tol
+    '''
+    textcleaner.init_textcleanner('portuguese', None)
+    originais = textcleaner.split_sentences(text)
+    filtradas = [_filtra_sentenca(s) for s in originais]
+
+    # nos do grafo: sentencas filtradas distintas (nao vazias)
+    nos = {}
+    for f in filtradas:
+        if f != '' and f not in nos:
+            nos[f] = len(nos)
+    n = len(nos)
+    if n == 0:
+        return []
+
+    # incidencia no x termo (conjunto de termos de cada no)
+    termos = {}
+    linhas = []
+    colunas = []
+    log_tamanho = np.empty(n)
+    for f, i in nos.items():
+        palavras = f.split()
+        log_tamanho[i] = log10(len(palavras))
+        for termo in set(palavras):
+            linhas.append(i)
+            colunas.append(termos.setdefault(termo, len(termos)))
+    incidencia = sparse.csr_matrix((np.ones(len(linhas)), (linhas, colunas)), shape=(n, len(termos)))
+
+    # similaridade = termos em comum / (log10 |s1| + log10 |s2|)
+    comuns = (incidencia @ incidencia.T).tocoo()
+    fora_diagonal = comuns.row != comuns.col
+    row, col, data = comuns.row[fora_diagonal], comuns.col[fora_diagonal], comuns.data[fora_diagonal]
+    denominador = log_tamanho[row] + log_tamanho[col]
+    validas = denominador != 0
+    row, col = row[validas], col[validas]
+    pesos = sparse.csr_matrix((data[validas] / denominador[validas], (row, col)), shape=(n, n))
+
+    if pesos.nnz == 0:
+        # todas as similaridades nulas: grafo completo com peso 1 (como no summa)
+        pesos = sparse.csr_matrix(np.ones((n, n)) - np.eye(n))
+
+    # remove nos sem arestas
+    soma = np.asarray(pesos.sum(axis=1)).ravel()
+    alcancaveis = np.flatnonzero(soma != 0)
+    scores_nos = np.zeros(n)
+    k = len(alcancaveis)
+    if k == 0:
+        return []
+    pesos = pesos[alcancaveis][:, alcancaveis]
+    transicao_t = sparse.diags(1 / soma[alcancaveis]).dot(pesos).T.tocsr()
+
+    # iteracao de potencia do PageRank (autovetor a esquerda da matriz do summa)
+    rank = np.full(k, 1.0 / k)
+    for _ in range(max_iter):
+        novo = damping * transicao_t.dot(rank) + (1 - damping) * rank.sum() / k
+        convergiu = np.abs(novo - rank).sum() <= tol
+        rank = novo
+        if convergiu:
+            break
+    scores_nos[alcancaveis] = np.abs(rank) / np.linalg.norm(rank)
+
+    return [(original, scores_nos[nos[f]] if f != '' else 0)
+            for original, f in zip(originais, filtradas) if f != '']
+
+
+class TabelaSentencas(object):
+    '''
+    Tabela compacta das sentencas do texto com o score TextRank de cada uma
+    (listas e arrays NumPy no lugar de um DataFrame).
+    Uma sentenca que o TextRank devolve mais de uma vez aparece repetida, como no merge original
+    '''
+
+    def __init__(self, sentencas, paragrafos, linhas, palavras, textrank):
+        self.sentencas = sentencas
+        self.paragrafos = np.asarray(paragrafos, dtype=np.int64)
+        self.linhas = np.asarray(linhas, dtype=np.int64)
+        self.palavras = np.asarray(palavras, dtype=np.int64)
+        self.textrank = np.asarray(textrank, dtype=float)
+
+    def __len__(self):
+        return len(self.sentencas)
+
+    def to_pandas(self):
+        return pd.DataFrame({'P#': self.paragrafos, 'S#': self.linhas, 'W#': self.palavras,
+                             'Sentenca': self.sentencas, 'TextRank': self.textrank})
+
+
+def tabela_sentencas(text, backend=None):
+    '''
+    Tabela de sentencas do texto com o score TextRank de cada uma.
+    Retorna None quando o texto e curto demais para ser sumarizado.
+    Calculada uma unica vez por texto, serve para qualquer taxa de compressao
+    backend: 'summa' ou 'nativo' (padrao TEXTRANK_BACKEND)
+    '''
+    sentencas, paragrafos, linhas, palavras = divide_sentencas(text)
+
+    if len(text) < 30 or len(sentencas) < 7:
+        return None
+
+    backend = backend or TEXTRANK_BACKEND
+    if backend == 'nativo':
+        sumario = textrank_scores(text)
+    elif backend == 'summa':
         sumario = summarizer.summarize(text, language='portuguese', scores=True, ratio=1.1)
-        dfSumario = pd.DataFrame(sumario, columns=['Sentenca', 'TextRank'])
-        dfTexto = pd.merge(left=dfTexto, right=dfSumario, how='left').fillna(0)
+    else:
+        raise ValueError("backend deve ser 'summa' ou 'nativo'")
+    scores = {}
+    for sentenca, score in sumario:
+        scores.setdefault(sentenca, []).append(score)
+
+    # equivalente ao merge left pela sentenca; a sentenca que o TextRank dividiu em outro ponto
+    # (ex.: abreviatura que o segmentador nao quebra) recebe o maior score dos trechos que ela cobre
+    sobreposicao = None
+    colunas = ([], [], [], [], [])
+    for linha, posicao in zip(zip(sentencas, paragrafos, linhas, palavras), _posicoes(text, sentencas)):
+        lista = scores.get(linha[0])
+        if lista is None:
+            if sobreposicao is None:
+                sobreposicao = _ScoresPorTrecho(text, sumario)
+            lista = [sobreposicao.score(*posicao)]
+        for score in lista:
+            for coluna, valor in zip(colunas, linha + (score,)):
+                coluna.append(valor)
+    return TabelaSentencas(*colunas)
+
+
+def _posicoes(text, sentencas):
+    '''
+    Posicoes (inicio, fim) no texto de sentencas que aparecem nele em ordem
+    '''
+    cursor = 0
+    for sentenca in sentencas:
+        inicio = text.find(sentenca, cursor)
+        if inicio < 0:
+            yield cursor, cursor
+            continue
+        cursor = inicio + len(sentenca)
+        yield inicio, cursor
 
-        df = dfTexto
 
-        total_words = np.sum(df['W#'])
+class _ScoresPorTrecho(object):
+    '''
+    Scores TextRank pela posicao no texto: score de um trecho = maior score das sentencas
+    do TextRank que se sobrepoem a ele (0 se nenhuma)
+    '''
 
-        if include_first_parag and np.sum(df[df['P#'] == 0]['W#']) >= (0.05 * total_words) :
-            df['TextRank'] = df.apply(lambda row: 999 if row['P#'] == 0 else row['TextRank'], axis=1)
+    def __init__(self, text, sumario):
+        self.inicios = []
+        self.fins = []
+        self.scores = []
+        for (inicio, fim), (_, score) in zip(_posicoes(text, [s for s, _ in sumario]), sumario):
+            if fim > inicio:
+                self.inicios.append(inicio)
+                self.fins.append(fim)
+                self.scores.append(score)
 
-        df = df.sort_values(by=['TextRank', 'S#'], ascending=[False, True])
+    def score(self, inicio, fim):
+        primeiro = bisect_right(self.fins, inicio)
+        ultimo = bisect_left(self.inicios, fim)
+        return max(self.scores[primeiro:ultimo], default=0)
 
-        df['SizeCum'] = df['W#'].cumsum()
 
-        dfSelected = df[df['SizeCum'] <= ( compression * total_words + 1)]
+def seleciona_sentencas(tabela, compression=0.8, include_first_parag=True):
+    '''
+    Seleciona as sentencas do sumario a partir da tabela de sentencas.
+    Retorna as posicoes das sentencas selecionadas, na ordem do texto
+    '''
+    palavras = tabela.palavras
+    textrank = tabela.textrank
+
+    total_words = palavras.sum()
+
+    primeiro = tabela.paragrafos == 0
+    if include_first_parag and palavras[primeiro].sum() >= (0.05 * total_words):
+        textrank = np.where(primeiro, 999, textrank)
+
+    # TextRank decrescente, S# crescente (ordenacao estavel)
+    ordem = np.lexsort((tabela.linhas, -textrank))
 
-        dfSelected = dfSelected.sort_values(by='S#')
+    size_cum = np.cumsum(palavras[ordem])
 
-        sumario = ''
+    selecionadas = ordem[size_cum <= (compression * total_words + 1)]
 
-        p_ant = 0
+    return selecionadas[np.argsort(tabela.linhas[selecionadas], kind='stable')]
 
-        for i, row in dfSelected.iterrows():
 
-            if row['P#'] != p_ant:
-                sumario = sumario + '\n'
-                sumario = sumario + row['Sentenca']
-                p_ant = row['P#']
-            else:
-                sumario = sumario + (' ' if i>0 else '') + row['Sentenca']
+def monta_sumario(tabela, selecionadas):
+    '''
+    Junta as sentencas selecionadas, quebrando linha na mudanca de paragrafo
+    '''
+    partes = []
+
+    p_ant = 0
 
+    for i in selecionadas:
+        paragrafo = tabela.paragrafos[i]
+        if paragrafo != p_ant:
+            partes.append('\n')
+            p_ant = paragrafo
+        elif i > 0:
+            partes.append(' ')
+        partes.append(tabela.sentencas[i])
 
-        return sumario
+    return ''.join(partes)
 
 
+def summarize_text_rank(text, compression=0.8, include_first_parag=True, backend=None):
+    '''
+    Sumariza o texto
+    '''
+    tabela = tabela_sentencas(text, backend)
+
+    if tabela is None:
+        return text
+    else:
+        return monta_sumario(tabela, seleciona_sentencas(tabela, compression, include_first_parag))
+
+
+
+
+def _sumariza_item(args):
+    return summarize_text_rank(*args)
+
+
+def summarize_many(textos, compression=0.8, include_first_parag=True, backend=None, n_jobs=-1, cache=CACHE_SUMARIOS):
+    '''
+    Sumariza varios textos em paralelo, guardando os sumarios em cache em disco.
+    A chave do cache e o hash do texto com a compressao, include_first_parag e o backend,
+    entao uma reconstrucao da base so sumariza noticias novas ou editadas.
+    cache: caminho do arquivo SQLite, um CacheDisco ou None (sem cache)
+    Retorna uma lista (ou Series com o mesmo indice, se textos for Series)
+    '''
+    indice = textos.index if isinstance(textos, pd.Series) else None
+    textos = list(textos)
+    backend = backend or TEXTRANK_BACKEND
+
+    if isinstance(cache, str):
+        cache = cache_compartilhado(cache)
+
+    chaves = [chave_conteudo(VERSAO_SUMARIO, t, float(compression), bool(include_first_parag), backend) for t in textos]
+    sumarios = cache.get_many(chaves) if cache is not None else {}
+
+    # textos ainda nao sumarizados (uma vez cada)
+    pendentes = {}
+    for chave, texto in zip(chaves, textos):
+        if chave not in sumarios and chave not in pendentes:
+            pendentes[chave] = texto
+
+    if pendentes:
+        args = [(texto, compression, include_first_parag, backend) for texto in pendentes.values()]
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = min(n_jobs, len(args))
+        if n_jobs == 1:
+            novos = [_sumariza_item(a) for a in args]
+        else:
+            with Pool(n_jobs) as pool:
+                novos = pool.map(_sumariza_item, args, chunksize=max(1, len(args) // (4 * n_jobs)))
+        novos = dict(zip(pendentes, novos))
+        if cache is not None:
+            cache.put_many(novos)
+        sumarios.update(novos)
+
+    resultado = [sumarios[chave] for chave in chaves]
+    if indice is not None:
+        return pd.Series(resultado, index=indice)
+    return resultado
 
 
 def teste_textrank():
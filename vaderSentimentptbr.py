@@ -19,11 +19,19 @@ import math
 import string
 import codecs
 import json
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict, deque
 from itertools import product
-from inspect import getsourcefile
-from io import open
+from io import open, StringIO
+from segmentador_sentencas import segmenta_sentencas
 import unicodedata
 import unidecode
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
 
 # ##Constants##
 
@@ -110,6 +118,8 @@ NEGATE = [
             'de jeito nenhum'
     ]
 
+NEGATE_SET = frozenset(NEGATE)
+
 # consideramos aqui adverbios de intensidade
 
 BOOSTER_DICT = {    
@@ -179,6 +189,28 @@ BOOSTER_DICT = {
     
     
 
+# version of the compiled lexicon snapshot (bump whenever its content changes)
+LEXICON_SNAPSHOT_VERSION = 1
+
+# folder, next to the lexicon file, where the compiled snapshots are stored
+LEXICON_SNAPSHOT_DIR = '.cache'
+
+# longest expression merged into a single token (ngrams_preprocessing)
+NGRAM_MAX_LENGTH = 6
+
+# owners of the n-gram trie expressions used by the main lexicon
+# (comparison lexicons add theirs, see add_comparison_lexicon)
+MAIN_OWNERS = frozenset(['lexicon', 'negate', 'booster'])
+
+# conjuncao adversativa que divide o peso da frase (ver _but_check)
+BUT_WORD = 'mas'
+BUT_WINDOW = 10
+
+# conjunctions used when the window is limited to the sentence (but_scope='sentence')
+BUT_WORDS = ('mas', 'entretanto', 'todavia', 'porem', 'contudo')
+
+RE_TOKEN = re.compile(r'\S+')
+
 # check for sentiment laden idioms that do not contain lexicon words (future work, not yet implemented)
 SENTIMENT_LADEN_IDIOMS = {}
 
@@ -205,11 +237,8 @@ def negated(input_words, include_nt=True):
     """
     Determine if input contains negation words
     """
-    input_words = [str(w).lower() for w in input_words]
-    neg_words = []
-    neg_words.extend(NEGATE)
-    for word in neg_words:
-        if word in input_words:
+    for word in input_words:
+        if str(word).lower() in NEGATE_SET:
             return True
     #if include_nt:
     #    for word in input_words:
@@ -273,51 +302,549 @@ def scalar_inc_dec(word, valence, is_cap_diff):
     return scalar
 
 
-def ngrams_preprocessing(tokens, lexicon, negations, boosters, max_lenghth=6):
+class NGramTrie(object):
+    """
+    Token-level trie with the multi-word expressions of the lexicon,
+    NEGATE and BOOSTER_DICT.
+    Built once per analyzer, it finds the longest n-gram starting at each
+    position in a single pass over the tokens.
+    """
+
+    # key of the terminal nodes, holding how many times each owner added the expression
+    END = None
+
+    def __init__(self):
+        self.root = {}
+
+    @classmethod
+    def from_sources(cls, lexicon, negations=NEGATE, boosters=BOOSTER_DICT):
+        trie = cls()
+        for word in lexicon:
+            trie.add(word, 'lexicon')
+        for word in negations:
+            trie.add(word, 'negate')
+        for word in boosters:
+            trie.add(word, 'booster')
+        return trie
+
+    def add(self, phrase, owner='lexicon'):
+        """
+        Add an expression. Single words are ignored since they are never merged
+        """
+        parts = phrase.split(' ')
+        if len(parts) < 2:
+            return
+        node = self.root
+        for part in parts:
+            node = node.setdefault(part, {})
+        owners = node.setdefault(self.END, {})
+        owners[owner] = owners.get(owner, 0) + 1
+
+    def remove(self, phrase, owner='lexicon'):
+        """
+        Remove one occurrence of an expression added by owner, pruning empty nodes
+        """
+        parts = phrase.split(' ')
+        if len(parts) < 2:
+            return
+        path = [self.root]
+        for part in parts:
+            node = path[-1].get(part)
+            if node is None:
+                return
+            path.append(node)
+        owners = path[-1].get(self.END)
+        if not owners or owner not in owners:
+            return
+        owners[owner] -= 1
+        if owners[owner] == 0:
+            del owners[owner]
+        if not owners:
+            del path[-1][self.END]
+        for k in range(len(parts), 0, -1):
+            if path[k]:
+                break
+            del path[k - 1][parts[k - 1]]
+
+    def __contains__(self, phrase):
+        node = self.root
+        for part in phrase.split(' '):
+            node = node.get(part)
+            if node is None:
+                return False
+        return self.END in node
+
+    def longest_match(self, token_parts, i, max_length=NGRAM_MAX_LENGTH, owners=MAIN_OWNERS):
+        """
+        Number of tokens of the longest expression (added by one of owners)
+        starting at position i, 1 when there is none.
+        token_parts holds, for each token, its lowercase/unaccented form split on spaces
+        """
+        best = 1
+        node = self.root
+        end = min(len(token_parts), i + max_length)
+        for k in range(i, end):
+            for part in token_parts[k]:
+                node = node.get(part)
+                if node is None:
+                    return best
+            if k > i:
+                found = node.get(self.END)
+                if found and not owners.isdisjoint(found):
+                    best = k - i + 1
+        return best
+
+    def matches(self, token_parts, i, max_length=NGRAM_MAX_LENGTH):
+        """
+        Every expression starting at position i, as (number of tokens, owners) pairs
+        """
+        found = []
+        node = self.root
+        end = min(len(token_parts), i + max_length)
+        for k in range(i, end):
+            for part in token_parts[k]:
+                node = node.get(part)
+                if node is None:
+                    return found
+            if k > i and self.END in node:
+                found.append((k - i + 1, frozenset(node[self.END])))
+        return found
+
+
+class _NGramWalks(object):
+    """
+    Walks the trie once per position and answers longest_match for any set of
+    owners from that walk (one n-gram pass shared by several lexicons)
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.walks = {}
+
+    def longest_match(self, token_parts, i, max_length=NGRAM_MAX_LENGTH, owners=MAIN_OWNERS):
+        found = self.walks.get(i)
+        if found is None:
+            found = self.walks[i] = self.matcher.matches(token_parts, i, max_length)
+        return self.best(found, owners)
+
+    @staticmethod
+    def best(found, owners):
+        best = 1
+        for length, expression_owners in found:
+            if not owners.isdisjoint(expression_owners):
+                best = length
+        return best
+
+
+def normalize_token(token):
+    return unidecode.unidecode(token.lower())
+
+
+def _merge_ngrams(tokens, tokens_lower, matcher, max_length=NGRAM_MAX_LENGTH, stop=None,
+                  owners=MAIN_OWNERS, token_parts=None):
+    """
+    Merge the n-grams found by matcher, returning the merged tokens, their lowercase forms
+    and how many tokens were consumed.
+    With stop, no n-gram starts at or after that position (used when more tokens are still to come)
+    """
+    # each token is normalized only once, not once per window
+    if token_parts is None:
+        token_parts = [unidecode.unidecode(t).split(' ') for t in tokens_lower]
     count = len(tokens)
+    if stop is None or stop > count:
+        stop = count
     new_tokens = []
-    
-    #print('tokens: ' + str(tokens))
+    new_tokens_lower = []
 
-    
     i = 0
-    while i < count:
-        step = 1
-        ngrams=[]
-        
-        ngrams = [   tokens[i+k]  for k in range(0, min(max_lenghth, count-i  ))   ]
-        
-        #print('ngrams: ' + str(i) + " " +  str(ngrams))
-        
-        for j in range(len(ngrams), 1, -1):  # find ngrams in lexicon or adverbs list
-            ngram = ' '.join(ngrams[:j])
-            ngram_adj =  unidecode.unidecode(ngram.lower())
-            #print ('termo pesquisado ' + str(ngram_adj))
-            if ngram_adj in lexicon or ngram_adj in negations or ngram_adj in boosters:
-                new_tokens.append(ngram)
-                step = j
-                break
+    while i < stop:
+        step = matcher.longest_match(token_parts, i, max_length, owners)
         if step == 1:  # only a single word
-            new_tokens.append( tokens[i] )  
-            
+            new_tokens.append(tokens[i])
+            new_tokens_lower.append(tokens_lower[i])
+        else:
+            ngram = ' '.join(tokens[i:i + step])
+            new_tokens.append(ngram)
+            new_tokens_lower.append(ngram.lower())
         i = i + step
-        
+
+    return new_tokens, new_tokens_lower, i
+
+
+def ngrams_preprocessing(tokens, lexicon, negations, boosters, max_lenghth=NGRAM_MAX_LENGTH, matcher=None):
+    """
+    Merge the n-grams (2 to max_lenghth tokens) found in the lexicon, negations or boosters,
+    always taking the longest one
+    """
+    if matcher is None:
+        matcher = NGramTrie.from_sources(lexicon, negations, boosters)
+    new_tokens, _, _ = _merge_ngrams(tokens, [t.lower() for t in tokens], matcher, max_lenghth)
     return new_tokens
 
 
+def _booster_pieces():
+    """
+    Every way of cutting the booster expressions into 2 or 3 consecutive pieces.
+    Only tokens among these pieces can form the booster n-grams of _special_idioms_check
+    """
+    pieces = set()
+    for phrase in BOOSTER_DICT:
+        words = phrase.split(' ')
+        n = len(words)
+        for a in range(1, n):
+            pieces.add(' '.join(words[:a]))
+            pieces.add(' '.join(words[a:]))
+            for b in range(a + 1, n):
+                pieces.add(' '.join(words[a:b]))
+                pieces.add(' '.join(words[b:]))
+    return pieces
+
+
+class TokenVocabulary(object):
+    """
+    Interns lowercase tokens to integer ids and keeps, per id, the features used by
+    the rules (valence, booster and negation flags) as NumPy arrays.
+    Only the tokens with some feature (lexicon words, boosters, negations and the words
+    the rules look for) get their own id; every other token maps to OTHER_ID, which has
+    none, so the vocabulary is bounded by the lexicons and does not grow with the corpus
+    """
+
+    OTHER_ID = 0
+
+    def __init__(self, lexicon, capacity=4096):
+        self.lexicon = lexicon
+        self.ids = {}
+        self.words = [None]
+        self.booster_pieces = _booster_pieces()
+        self._allocate(capacity)
+        self.add_words(lexicon)
+        self.add_words(BOOSTER_DICT)
+        self.add_words(NEGATE_SET)
+        self.add_words(self.booster_pieces)
+        self.id_sem = self.intern_word('sem')
+        self.id_duvida = self.intern_word('duvida')
+        self.id_but = self.intern_word(BUT_WORD)
+        self.but_ids = np.array([self.intern_word(w) for w in BUT_WORDS], dtype=np.intp)
+
+    def _allocate(self, capacity):
+        old_size = len(self.words)
+        def grow(array, dtype):
+            new = np.zeros(capacity, dtype=dtype)
+            if array is not None:
+                new[:old_size] = array[:old_size]
+            return new
+        self.valence = grow(getattr(self, 'valence', None), np.float64)
+        self.in_lexicon = grow(getattr(self, 'in_lexicon', None), bool)
+        self.booster = grow(getattr(self, 'booster', None), np.float64)
+        self.is_booster = grow(getattr(self, 'is_booster', None), bool)
+        self.is_negate = grow(getattr(self, 'is_negate', None), bool)
+        self.is_booster_piece = grow(getattr(self, 'is_booster_piece', None), bool)
+
+    def _set_features(self, i, word):
+        valence = self.lexicon.get(word)
+        self.in_lexicon[i] = valence is not None
+        self.valence[i] = valence if valence is not None else 0.0
+        self.is_booster[i] = word in BOOSTER_DICT
+        self.booster[i] = BOOSTER_DICT.get(word, 0.0)
+        self.is_negate[i] = word in NEGATE_SET
+        self.is_booster_piece[i] = word in self.booster_pieces
+
+    def intern_word(self, word):
+        i = self.ids.get(word)
+        if i is None:
+            i = len(self.words)
+            if i == len(self.valence):
+                self._allocate(2 * len(self.valence))
+            self.ids[word] = i
+            self.words.append(word)
+            self._set_features(i, word)
+        return i
+
+    def add_words(self, words):
+        for word in words:
+            self.intern_word(word)
+
+    def intern(self, words):
+        get = self.ids.get
+        other = self.OTHER_ID
+        return np.array([get(word, other) for word in words], dtype=np.intp)
+
+    def refresh(self, words):
+        """
+        Recompute the features of the words after the lexicon changed (interning the new ones)
+        """
+        for word in words:
+            i = self.ids.get(word)
+            if i is None:
+                self.intern_word(word)
+            else:
+                self._set_features(i, word)
+
+
+class LexiconValences(object):
+    """
+    Valences of another lexicon for the tokens of a TokenVocabulary, as arrays indexed
+    by the vocabulary ids (comparison lexicons reuse the ids of the main vocabulary)
+    """
+
+    def __init__(self, lexicon, capacity=4096):
+        self.lexicon = lexicon
+        self.size = 0
+        self.valence = np.zeros(capacity, dtype=np.float64)
+        self.in_lexicon = np.zeros(capacity, dtype=bool)
+
+    def arrays(self, vocab):
+        """
+        (valence, in_lexicon) for every token interned so far in vocab
+        """
+        size = len(vocab.words)
+        if size > self.size:
+            if size > len(self.valence):
+                capacity = max(size, 2 * len(self.valence))
+                self.valence = np.concatenate([self.valence, np.zeros(capacity - len(self.valence))])
+                self.in_lexicon = np.concatenate([self.in_lexicon, np.zeros(capacity - len(self.in_lexicon), dtype=bool)])
+            for i in range(self.size, size):
+                valence = self.lexicon.get(vocab.words[i])
+                if valence is not None:
+                    self.valence[i] = valence
+                    self.in_lexicon[i] = True
+            self.size = size
+        return self.valence, self.in_lexicon
+
+
+def _contrastive_adjust(sentiments, bi, window=BUT_WINDOW):
+    """
+    Array version of _but_check for the conjunction at position bi (changes sentiments in place).
+    Values within the window before it are halved and after it multiplied by 1.5.
+    As in the original list.index() lookup, each value changes its first
+    occurrence in the list, so it is only applied when that one is inside the window
+    """
+    n = len(sentiments)
+    lo = max(0, bi - window + 1)
+    hi = min(n - 1, bi + window - 1)
+    before = set(sentiments[:lo].tolist())
+    for k in (np.flatnonzero(sentiments[lo:]) + lo).tolist():
+        value = float(sentiments[k])
+        if value in before:
+            continue
+        for si in range(lo, min(k, hi) + 1):
+            if sentiments[si] == value:
+                break
+        else:
+            continue
+        if si < bi:
+            sentiments[si] = value * 0.5
+        elif si > bi:
+            sentiments[si] = value * 1.5
+
+
+def _raw_token_sentences(text):
+    # sentence index of each whitespace token of text
+    starts = [m.start() for m in RE_TOKEN.finditer(text)]
+    bounds = [start for start, _ in segmenta_sentencas(text)]
+    return np.searchsorted(np.array(bounds, dtype=np.int64), np.array(starts, dtype=np.int64), side='right')
+
+
+def _sentence_fragments(text):
+    """
+    Cut the text at sentence starts that follow ASCII whitespace. The fragments cover the
+    whole text and no token crosses a cut, so their front-ends can be joined
+    """
+    cut = 0
+    for start, _ in segmenta_sentencas(text, abreviaturas=False):
+        if start > cut and text[start - 1] in ' \t\n\r\f\v':
+            yield text[cut:start]
+            cut = start
+    yield text[cut:]
+
+
+def _split_block(buffer):
+    """
+    Cut a buffer after its last sentence end (or at least after its last space/line break).
+    Cuts only at ASCII whitespace, which the preprocessing keeps, so no token is split
+    """
+    cut = max(buffer.rfind('\n'), buffer.rfind('. ') + 1, buffer.rfind('! ') + 1, buffer.rfind('? ') + 1)
+    if cut <= 0:
+        cut = max(buffer.rfind(' '), buffer.rfind('\t'))
+    if cut < 0:
+        return '', buffer
+    return buffer[:cut + 1], buffer[cut + 1:]
+
+
+class _ContrastStream(object):
+    """
+    Streaming version of _contrastive_adjust together with the sums of score_valence.
+    Values are summed as soon as they can no longer change; only the values around
+    the first 'mas' and the set of values seen before that window are kept
+    """
+
+    def __init__(self, window=BUT_WINDOW):
+        self.window = window
+        self.position = 0
+        self.bi = None
+        self.lo = None
+        self.recent = deque()
+        self.seen_before = set()
+        self.active = []
+        self.sum_s = 0.0
+        self.pos_sum = 0.0
+        self.neg_sum = 0.0
+        self.neu_count = 0
+
+    def _add(self, value):
+        self.sum_s += value
+        if value > 0:
+            self.pos_sum += value + 1
+        elif value < 0:
+            self.neg_sum += value - 1
+        else:
+            self.neu_count += 1
+
+    def _first_active(self, value, last):
+        # first position of the window (up to last) holding value, as list.index() would find it
+        if value == 0 or value in self.seen_before:
+            return None
+        for j in range(0, min(last, len(self.active) - 1) + 1):
+            if self.active[j] == value:
+                return j
+        return None
+
+    def _visit(self, k, value):
+        j = self._first_active(value, k)
+        if j is None:
+            return
+        if self.lo + j < self.bi:
+            self.active[j] = value * 0.5
+        elif self.lo + j > self.bi:
+            self.active[j] = value * 1.5
+
+    def push(self, values, is_but):
+        hi = None if self.bi is None else self.bi + self.window - 1
+        for value, but in zip(values.tolist(), is_but.tolist()):
+            g = self.position
+            self.position += 1
+            if self.bi is None:
+                if not but:
+                    self.recent.append(value)
+                    if len(self.recent) > self.window - 1:
+                        old = self.recent.popleft()
+                        self.seen_before.add(old)
+                        self._add(old)
+                    continue
+                # first 'mas': the preceding values become the start of the window
+                self.bi = g
+                hi = g + self.window - 1
+                self.lo = g - len(self.recent)
+                self.active = list(self.recent)
+                self.recent = None
+                for k in range(len(self.active)):
+                    self._visit(k, self.active[k])
+            if g <= hi:
+                self.active.append(value)
+                self._visit(g - self.lo, value)
+            else:
+                self._visit(len(self.active), value)
+                self._add(value)
+
+    def sums(self):
+        for value in (self.recent if self.bi is None else self.active):
+            self._add(value)
+        self.recent = deque()
+        self.active = []
+        return self.sum_s, self.pos_sum, self.neg_sum, self.neu_count
+
+
+class ScoreCache(object):
+    """
+    Bounded LRU cache keyed by a hash of the text (scores of whole texts,
+    or the token front-end of sentences)
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __getstate__(self):
+        # locks can't be pickled (analyzer sent to pool workers); workers start empty
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_data'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
 class SentiText(object):
     """
     Identify sentiment-relevant string-level properties of input text.
     """
 
-    def __init__(self, text, lexicon_keys):
+    def __init__(self, text, lexicon_keys, matcher=None):
         if not isinstance(text, str):
             text = str(text).encode('utf-8')
         self.text = text
-        self.words_and_emoticons = self._words_and_emoticons(lexicon_keys)
+        self.matcher = matcher
+        # sentence of each whitespace token, when known beforehand (see polarity_scores_fragments)
+        self.raw_sentences = None
         # doesn't separate words from\
         # adjacent punctuation (keeps emoticons & contractions)
-        self.is_cap_diff = allcap_differential(self.words_and_emoticons)
+        self.words_and_emoticons, self.words_lower = self._words_and_emoticons(lexicon_keys)
+        self._detect_caps()
+
+    @classmethod
+    def from_tokens(cls, words, words_lower, token_parts, matcher):
+        """
+        SentiText of tokens already split and stripped (e.g. cached per sentence)
+        """
+        sentitext = cls.__new__(cls)
+        sentitext.text = None
+        sentitext.matcher = matcher
+        sentitext.raw_sentences = None
+        sentitext.words_and_emoticons, sentitext.words_lower, _ = _merge_ngrams(
+            words, words_lower, matcher, token_parts=token_parts)
+        sentitext._detect_caps()
+        return sentitext
+
+    def _detect_caps(self):
+        # caps detection done once, reused by the rules
+        self.is_upper = [w.isupper() for w in self.words_and_emoticons]
+        allcap_words = sum(self.is_upper)
+        self.is_cap_diff = 0 < allcap_words < len(self.is_upper)
 
     @staticmethod
     def _strip_punc_if_word(token):
@@ -337,37 +864,152 @@ class SentiText(object):
         Removes leading and trailing puncutation
         Leaves contractions and most emoticons
             Does not preserve punc-plus-letter emoticons (e.g. :D)
+        Returns the tokens (with n-grams merged) and their lowercase forms
         """
         wes = self.text.split()
         stripped = list(map(self._strip_punc_if_word, wes))
-        
-        stripped = ngrams_preprocessing(stripped, lexicon, NEGATE, BOOSTER_DICT )
-        
-        return stripped
+
+        if self.matcher is None:
+            self.matcher = NGramTrie.from_sources(lexicon)
+        new_tokens, new_tokens_lower, _ = _merge_ngrams(stripped, [w.lower() for w in stripped], self.matcher)
+        return new_tokens, new_tokens_lower
+
+# #Compiled lexicon snapshot# #
+
+def _read_text_file(path):
+    with codecs.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def _snapshot_path(lexicon_file, emoji_lexicon):
+    name = '{0}.{1}.pkl'.format(os.path.basename(lexicon_file), os.path.basename(emoji_lexicon))
+    return os.path.join(os.path.dirname(os.path.abspath(lexicon_file)), LEXICON_SNAPSHOT_DIR, name)
+
+
+def _sources_stat(files):
+    return [(os.path.abspath(f), os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in files]
+
+
+def _sources_hash(files):
+    digest = hashlib.sha1()
+    for f in files:
+        with open(f, 'rb') as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def load_lexicon_snapshot(lexicon_file, emoji_lexicon):
+    """
+    Load the compiled lexicon (lexicon and emoji dicts plus the n-gram trie).
+    Returns None when there is no snapshot or it is stale: the snapshot is
+    valid if the sources keep the same mtime/size, or else the same content hash
+    """
+    path = _snapshot_path(lexicon_file, emoji_lexicon)
+    sources = [lexicon_file, emoji_lexicon]
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+    if snapshot.get('version') != LEXICON_SNAPSHOT_VERSION:
+        return None
+    if snapshot.get('stat') == _sources_stat(sources):
+        return snapshot
+    if snapshot.get('sha1') == _sources_hash(sources):
+        # same content with a new mtime (e.g. after a checkout): refresh the stat
+        save_lexicon_snapshot(lexicon_file, emoji_lexicon, snapshot)
+        return snapshot
+    return None
+
+
+def save_lexicon_snapshot(lexicon_file, emoji_lexicon, compiled):
+    """
+    Save the compiled lexicon next to the source file. Failing to write
+    (read-only folder, for instance) only means the next load parses the sources again
+    """
+    path = _snapshot_path(lexicon_file, emoji_lexicon)
+    sources = [lexicon_file, emoji_lexicon]
+    snapshot = dict(compiled)
+    snapshot.update({'version': LEXICON_SNAPSHOT_VERSION,
+                     'stat': _sources_stat(sources),
+                     'sha1': _sources_hash(sources)})
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # writes to a temporary file first so concurrent readers never see a partial snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError):
+        pass
+
 
 class SentimentIntensityAnalyzer(object):
     """
     Give a sentiment intensity score to sentences.
     """
 
-    def __init__(self, lexicon_file="datasets/vader_lexico_ptbr.txt", emoji_lexicon="datasets/emoji_utf8_lexicon.txt"):
-        _this_module_file_path_ = os.path.abspath(getsourcefile(lambda: 0))
+    def __init__(self, lexicon_file="datasets/vader_lexico_ptbr.txt", emoji_lexicon="datasets/emoji_utf8_lexicon.txt",
+                 use_snapshot=True, cache_size=0, comparison_lexicons=None, but_scope='text',
+                 sentence_cache_size=0):
         #lexicon_full_filepath = os.path.join(os.path.dirname(_this_module_file_path_), lexicon_file)
-        lexicon_full_filepath = lexicon_file
-        with codecs.open(lexicon_full_filepath, encoding='utf-8') as f:
-            self.lexicon_full_filepath = f.read()
-        self.lexicon = self.make_lex_dict()
-
         #emoji_full_filepath = os.path.join(os.path.dirname(_this_module_file_path_), emoji_lexicon)
-        emoji_full_filepath = emoji_lexicon
-        with codecs.open(emoji_full_filepath, encoding='utf-8') as f:
-            self.emoji_full_filepath = f.read()
-        self.emojis = self.make_emoji_dict()
+        self.lexicon_file = lexicon_file
+        self.emoji_lexicon = emoji_lexicon
+
+        # 'text': only the first 'mas' of the text, window of BUT_WINDOW tokens (original behaviour)
+        # 'sentence': first contrastive conjunction of each sentence, window kept inside it
+        if but_scope not in ('text', 'sentence'):
+            raise ValueError("but_scope must be 'text' or 'sentence'")
+        self.but_scope = but_scope
+
+        # compiled lexicon saved by a previous run, when the source files did not change
+        snapshot = load_lexicon_snapshot(lexicon_file, emoji_lexicon) if use_snapshot else None
+        if snapshot is not None:
+            self.lexicon = snapshot['lexicon']
+            self.emojis = snapshot['emojis']
+            self.ngram_matcher = snapshot['ngram_matcher']
+        else:
+            self.lexicon_full_filepath = _read_text_file(lexicon_file)
+            self.lexicon = self.make_lex_dict()
+            self.ngram_matcher = NGramTrie.from_sources(self.lexicon)
+
+            self.emoji_full_filepath = _read_text_file(emoji_lexicon)
+            self.emojis = self.make_emoji_dict()
+
+            if use_snapshot:
+                save_lexicon_snapshot(lexicon_file, emoji_lexicon,
+                                      {'lexicon': self.lexicon, 'emojis': self.emojis,
+                                       'ngram_matcher': self.ngram_matcher})
+
+        # token ids and their features, shared by every text scored by this analyzer
+        self.vocabulary = TokenVocabulary(self.lexicon)
+
+        # scores of repeated texts (titles), disabled when cache_size is 0
+        self.cache = ScoreCache(cache_size) if cache_size else None
+
+        # token front-end of repeated sentences (footers inside different articles),
+        # disabled when sentence_cache_size is 0. It does not depend on the lexicon
+        self.sentence_cache = ScoreCache(sentence_cache_size) if sentence_cache_size else None
+
+        # small lexicons applied over the base one, in insertion order (see add_overlay)
+        self.overlays = OrderedDict()
+        self.overlay_files = {}
+        self.base_lexicon = None
+
+        # other lexicons scored in the same pass (see polarity_scores_lexicons)
+        self.comparison_lexicons = OrderedDict()
+        for name, path in (comparison_lexicons or {}).items():
+            self.add_comparison_lexicon(name, path)
 
     def make_lex_dict(self):
         """
         Convert lexicon file to a dictionary
         """
+        if getattr(self, 'lexicon_full_filepath', None) is None:
+            self.lexicon_full_filepath = _read_text_file(self.lexicon_file)
         lex_dict = {}
         for line in self.lexicon_full_filepath.rstrip('\n').split('\n'):
             if not line:
@@ -378,51 +1020,378 @@ class SentimentIntensityAnalyzer(object):
             lex_dict[word] = float(measure)
         return lex_dict
 
+    # #Overlay lexicons# #
+
+    @staticmethod
+    def _overlay_entries(entries):
+        """
+        Normalize overlay entries the same way as make_lex_dict.
+        Accepts a dict, (word, valence) pairs or a DataFrame with the columns sintagma/polaridade
+        """
+        if isinstance(entries, pd.DataFrame):
+            entries = zip(entries['sintagma'], entries['polaridade'])
+        elif isinstance(entries, dict):
+            entries = entries.items()
+        overlay = {}
+        for word, measure in entries:
+            if pd.isna(word) or pd.isna(measure):
+                continue
+            overlay[unidecode.unidecode(str(word).lower().strip())] = float(measure)
+        return overlay
+
+    @staticmethod
+    def _read_overlay_file(path):
+        if path.lower().endswith(('.xlsx', '.xls')):
+            return pd.read_excel(path)
+        return [line.strip().split('\t')[0:2] for line in _read_text_file(path).split('\n') if line.strip()]
+
+    def add_overlay(self, name, entries):
+        """
+        Add (or replace) an overlay lexicon. Its valences take precedence over the
+        base lexicon and over the overlays added before it. Only the changed words are
+        updated in the n-gram trie and token features, and the score cache is cleared
+        """
+        overlay = self._overlay_entries(entries)
+        previous = self.overlays.pop(name, {})
+        self.overlays[name] = overlay
+        self._update_lexicon(set(previous) | set(overlay))
+
+    def remove_overlay(self, name):
+        overlay = self.overlays.pop(name, None)
+        self.overlay_files.pop(name, None)
+        if overlay is not None:
+            self._update_lexicon(overlay)
+
+    def load_overlay(self, name, path):
+        """
+        Add an overlay from a file: xlsx with the columns sintagma/polaridade
+        (e.g. datasets/expressoes_senti_lex_adicionar.xlsx) or a tab separated lexicon
+        """
+        self.add_overlay(name, self._read_overlay_file(path))
+        self.overlay_files[name] = path
+
+    def reload_overlay(self, name, entries=None):
+        """
+        Reload an overlay from its file (or with new entries), keeping its position
+        """
+        if entries is None:
+            entries = self._read_overlay_file(self.overlay_files[name])
+        overlay = self._overlay_entries(entries)
+        previous = self.overlays[name]
+        self.overlays[name] = overlay
+        self._update_lexicon(set(previous) | set(overlay))
+
+    def _update_lexicon(self, words):
+        # the base lexicon is copied only once, when the first overlay arrives
+        if self.base_lexicon is None:
+            self.base_lexicon = dict(self.lexicon)
+
+        for word in words:
+            value = self.base_lexicon.get(word)
+            for overlay in self.overlays.values():
+                if word in overlay:
+                    value = overlay[word]
+            if value is None:
+                if word in self.lexicon:
+                    del self.lexicon[word]
+                    self.ngram_matcher.remove(word, 'lexicon')
+            else:
+                if word not in self.lexicon:
+                    self.ngram_matcher.add(word, 'lexicon')
+                self.lexicon[word] = value
+
+        self.vocabulary.refresh(words)
+        self.cache_clear()
+
+    # #Comparison lexicons# #
+
+    def add_comparison_lexicon(self, name, lexicon):
+        """
+        Add a lexicon (file path or dict) to be scored together with the main one.
+        Its multi-word expressions go into the same n-gram trie, under their own owner
+        """
+        if isinstance(lexicon, str):
+            lexicon = SentimentIntensityAnalyzer(lexicon, self.emoji_lexicon).lexicon
+        else:
+            lexicon = self._overlay_entries(lexicon)
+        self.remove_comparison_lexicon(name)
+        owner = ('comparison', name)
+        for word in lexicon:
+            self.ngram_matcher.add(word, owner)
+        self.vocabulary.add_words(lexicon)
+        self.comparison_lexicons[name] = LexiconValences(lexicon)
+
+    def remove_comparison_lexicon(self, name):
+        valences = self.comparison_lexicons.pop(name, None)
+        if valences is not None:
+            for word in valences.lexicon:
+                self.ngram_matcher.remove(word, ('comparison', name))
+
+    def polarity_scores_lexicons(self, text):
+        """
+        Scores of the text with the main lexicon ('base') and each comparison lexicon.
+        Preprocessing, tokenization, the n-gram trie walk, the token ids and the caps
+        flags are computed once. A comparison lexicon that picks the same n-grams as the
+        base one also reuses its merge; per lexicon only the valences and rules change
+        """
+        text = self.preprocess(text)
+        words = [SentiText._strip_punc_if_word(w) for w in text.split()]
+        words_lower = [w.lower() for w in words]
+        # preprocess already folded the text to ASCII, so each token is its only part
+        token_parts = [[w] for w in words_lower]
+        walks = _NGramWalks(self.ngram_matcher)
+        vocab = self.vocabulary
+        ep_count = text.count('!')
+        qm_count = text.count('?')
+
+        def front_end(owners):
+            merged, merged_lower, _ = _merge_ngrams(words, words_lower, walks, owners=owners,
+                                                    token_parts=token_parts)
+            is_upper = np.array([w.isupper() for w in merged], dtype=bool)
+            allcap_words = int(is_upper.sum())
+            is_cap_diff = 0 < allcap_words < len(merged)
+            return merged_lower, is_upper, is_cap_diff, vocab.intern(merged_lower)
+
+        # the lexicons whose merge is the same as the base one (every position of the base
+        # walk with an n-gram match picks the same length) are scored together
+        groups = [(['base'], front_end(MAIN_OWNERS))]
+        matched = [found for found in walks.walks.values() if found]
+        base_choices = [walks.best(found, MAIN_OWNERS) for found in matched]
+        for name in self.comparison_lexicons:
+            owners = frozenset(['negate', 'booster', ('comparison', name)])
+            if [walks.best(found, owners) for found in matched] == base_choices:
+                groups[0][0].append(name)
+            else:
+                groups.append(([name], front_end(owners)))
+
+        def arrays(name):
+            if name == 'base':
+                return vocab.valence, vocab.in_lexicon
+            return self.comparison_lexicons[name].arrays(vocab)
+
+        scores = OrderedDict((name, None) for name in ['base'] + list(self.comparison_lexicons))
+        for names, (merged_lower, is_upper, is_cap_diff, ids) in groups:
+            sentiments = self._rule_valences(ids, is_upper, is_cap_diff, merged_lower,
+                                             valences=[arrays(name) for name in names])
+            for name, row in zip(names, sentiments):
+                self._contrastive_check(row, ids, merged_lower, text=text)
+                scores[name] = self._scores_from_array(row, ep_count, qm_count)
+        return scores
+
+    def compare_lexicons(self, texts):
+        """
+        Compound score of each text (rows) with each lexicon (columns)
+        """
+        index = texts.index if isinstance(texts, pd.Series) else None
+        rows = [[s['compound'] for s in self.polarity_scores_lexicons(t).values()] for t in texts]
+        columns = ['base'] + list(self.comparison_lexicons)
+        return pd.DataFrame(np.array(rows, dtype=float).reshape(len(rows), len(columns)),
+                            columns=columns, index=index)
+
     def make_emoji_dict(self):
         """
         Convert emoji lexicon file to a dictionary
         """
+        if getattr(self, 'emoji_full_filepath', None) is None:
+            self.emoji_full_filepath = _read_text_file(self.emoji_lexicon)
         emoji_dict = {}
         for line in self.emoji_full_filepath.rstrip('\n').split('\n'):
             (emoji, description) = line.strip().split('\t')[0:2]
             emoji_dict[emoji] = description
         return emoji_dict
 
+    def replace_emojis(self, text):
+        """
+        Convert emojis to their textual descriptions.
+        Only single characters of the emoji lexicon are replaced, and pure ASCII
+        text (almost all news) skips the stage
+        """
+        if text.isascii():
+            return text
+        emoji_chars = self.__dict__.get('_emoji_chars')
+        if emoji_chars is None:
+            emoji_chars = frozenset(e for e in self.emojis if len(e) == 1)
+            self._emoji_chars = emoji_chars
+        found = emoji_chars.intersection(text)
+        if not found:
+            return text
+        pattern = re.compile('[' + ''.join(re.escape(c) for c in sorted(found)) + ']')
+
+        def description(match):
+            # separated by a space unless it comes right after a space (or starts the text)
+            start = match.start()
+            prefix = '' if start == 0 or text[start - 1] == ' ' else ' '
+            return prefix + self.emojis[match.group()]
+
+        return pattern.sub(description, text)
+
+    def preprocess(self, text):
+        """
+        Emoji substitution and accent folding, before tokenization
+        """
+        text = self.replace_emojis(text).strip()
+
+        # portuguese preprocessing
+        return portuguese_preprocessing(text, self.lexicon)
+
+    def normalize(self, text):
+        """
+        Text front-end: emoji substitution, accent folding, tokenization,
+        punctuation stripping, n-gram merging and caps detection.
+        Returns a SentiText with the tokens and their lowercase forms
+        """
+        return SentiText(self.preprocess(text), self.lexicon, self.ngram_matcher)
+
     def polarity_scores(self, text):
         """
         Return a float for sentiment strength based on the input text.
         Positive values are positive valence, negative value are negative
         valence.
         """
-        
-        # convert emojis to their textual descriptions
-        text_no_emoji = ""
-        prev_space = True
-        for chr in text:
-            if chr in self.emojis:
-                # get the textual description
-                description = self.emojis[chr]
-                if not prev_space:
-                    text_no_emoji += ' '
-                text_no_emoji += description
-                prev_space = False
+        # repeated texts are neither tokenized nor scored again
+        if self.cache is not None:
+            key = ScoreCache.key(text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return dict(cached)
+
+        if self.sentence_cache is not None and self.but_scope == 'text':
+            # repeated sentences reuse their front-end; n-grams, caps and the rules
+            # still see the whole text
+            valence_dict = self._scores_from_fragments(
+                [self._sentence_front_end(f) for f in _sentence_fragments(text)])
+        else:
+            text = self.preprocess(text)
+            sentitext = SentiText(text, self.lexicon, self.ngram_matcher)
+
+            if VERBOSE or SPECIAL_CASES:
+                # rules token by token (prints the valences / handles the special cases)
+                sentiments = self._sentiments_by_token(sentitext)
             else:
-                text_no_emoji += chr
-                prev_space = chr == ' '
-        text = text_no_emoji.strip()
-        
-        # portuguese preprocessing
-        text = portuguese_preprocessing(text, self.lexicon)
+                sentiments = self.sentiments_array(sentitext).tolist()
+
+            valence_dict = self.score_valence(sentiments, text)
+
+        if self.cache is not None:
+            self.cache.put(key, dict(valence_dict))
+
+        return valence_dict
+
+    # #Pre-tokenized fragments# #
 
-        sentitext = SentiText(text, self.lexicon)
+    def fragment_tokens(self, fragment):
+        """
+        Front-end of a text fragment (e.g. one sentence), to be cached and scored later
+        together with other fragments: its tokens before n-gram merging and its '!'/'?' counts
+        """
+        words, _, _, ep_count, qm_count = self._sentence_front_end(fragment)
+        return words, ep_count, qm_count
+
+    def _sentence_front_end(self, fragment):
+        # tokens, lowercase forms, normalized parts (for the n-gram trie) and '!'/'?' counts
+        if self.sentence_cache is not None:
+            key = ScoreCache.key(fragment)
+            cached = self.sentence_cache.get(key)
+            if cached is not None:
+                return cached
+        text = self.preprocess(fragment)
+        words = [SentiText._strip_punc_if_word(w) for w in text.split()]
+        words_lower = [w.lower() for w in words]
+        # preprocess already folded the text to ASCII, so each token is its only part
+        token_parts = [[w] for w in words_lower]
+        front_end = (words, words_lower, token_parts, text.count('!'), text.count('?'))
+        if self.sentence_cache is not None:
+            self.sentence_cache.put(key, front_end)
+        return front_end
+
+    def _scores_from_fragments(self, front_ends):
+        # scores of the text made of the fragments (outputs of _sentence_front_end)
+        words = []
+        words_lower = []
+        token_parts = []
+        ep_count = 0
+        qm_count = 0
+        for fragment_words, fragment_lower, fragment_parts, fragment_ep, fragment_qm in front_ends:
+            words.extend(fragment_words)
+            words_lower.extend(fragment_lower)
+            token_parts.extend(fragment_parts)
+            ep_count += fragment_ep
+            qm_count += fragment_qm
+
+        sentitext = SentiText.from_tokens(words, words_lower, token_parts, self.ngram_matcher)
+        if VERBOSE or SPECIAL_CASES:
+            sentiments = self._sentiments_by_token(sentitext)
+        else:
+            sentiments = self.sentiments_array(sentitext).tolist()
+        return self._scores_from_sentiments(sentiments, ep_count, qm_count)
 
+    def polarity_scores_fragments(self, fragments):
+        """
+        Scores of the fragments (outputs of fragment_tokens) joined by whitespace.
+        Same result as polarity_scores of the joined text: n-grams, caps and the 'mas'
+        window still see the whole text, only the per-fragment front-end is reused
+        """
+        words = []
+        raw_sentences = []
+        ep_count = 0
+        qm_count = 0
+        for k, (fragment_words, fragment_ep, fragment_qm) in enumerate(fragments):
+            words.extend(fragment_words)
+            raw_sentences.extend([k] * len(fragment_words))
+            ep_count += fragment_ep
+            qm_count += fragment_qm
+
+        # with but_scope='sentence' each fragment is taken as a sentence
+        sentitext = SentiText(' '.join(words), self.lexicon, self.ngram_matcher)
+        sentitext.raw_sentences = np.array(raw_sentences, dtype=np.int64)
+        if VERBOSE or SPECIAL_CASES:
+            sentiments = self._sentiments_by_token(sentitext)
+        else:
+            sentiments = self.sentiments_array(sentitext).tolist()
+
+        return self._scores_from_sentiments(sentiments, ep_count, qm_count)
+
+    def _scores_from_array(self, sentiments, ep_count, qm_count):
+        # same as _scores_from_sentiments: zeros only count as neutral (adding 0.0 keeps the sums)
+        if not len(sentiments):
+            return self._scores_from_sums(None, 0.0, 0.0, 0, 0.0)
+        nonzero = sentiments[sentiments != 0].tolist()
+        pos_sum, neg_sum, _ = self._sift_sentiment_scores(nonzero)
+        return self._scores_from_sums(float(sum(nonzero)), pos_sum, neg_sum, len(sentiments) - len(nonzero),
+                                      self._punctuation_emphasis(None, ep_count, qm_count))
+
+    def _scores_from_sentiments(self, sentiments, ep_count, qm_count):
+        if not sentiments:
+            return self._scores_from_sums(None, 0.0, 0.0, 0, 0.0)
+        pos_sum, neg_sum, neu_count = self._sift_sentiment_scores(sentiments)
+        return self._scores_from_sums(float(sum(sentiments)), pos_sum, neg_sum, neu_count,
+                                      self._punctuation_emphasis(None, ep_count, qm_count))
+
+    def cache_info(self):
+        """
+        Hits, misses and size of the score cache (None when disabled)
+        """
+        return self.cache.info() if self.cache is not None else None
+
+    def sentence_cache_info(self):
+        """
+        Hits, misses and size of the sentence front-end cache (None when disabled)
+        """
+        return self.sentence_cache.info() if self.sentence_cache is not None else None
+
+    def cache_clear(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _sentiments_by_token(self, sentitext):
         sentiments = []
         words_and_emoticons = sentitext.words_and_emoticons
         #print(words_and_emoticons)
+        words_lower = sentitext.words_lower
         for i, item in enumerate(words_and_emoticons):
             valence = 0
             # check for vader_lexicon words that may be used as modifiers or negations
-            if item.lower() in BOOSTER_DICT:
+            if words_lower[i] in BOOSTER_DICT:
                 sentiments.append(valence)
                 continue
             # n/a for portuguese
@@ -433,16 +1402,142 @@ class SentimentIntensityAnalyzer(object):
 
             sentiments = self.sentiment_valence(valence, sentitext, item, i, sentiments)
 
-        sentiments = self._but_check(words_and_emoticons, sentiments)
+        if self.but_scope == 'sentence':
+            ids = self.vocabulary.intern(words_lower)
+            return self._contrastive_check(np.array(sentiments, dtype=np.float64), ids, words_lower,
+                                           text=sentitext.text, raw_sentences=sentitext.raw_sentences).tolist()
+        return self._but_check(words_lower, sentiments)
 
-        valence_dict = self.score_valence(sentiments, text)
+    def sentiments_array(self, sentitext):
+        """
+        Same rules as sentiment_valence/_but_check, applied with NumPy over the
+        token ids of the text: each window (3 preceding tokens, 'mas') is an array
+        operation over all the lexicon words at once
+        """
+        vocab = self.vocabulary
+        ids = vocab.intern(sentitext.words_lower)
+        sentiments = self._rule_valences(ids, np.array(sentitext.is_upper, dtype=bool),
+                                         sentitext.is_cap_diff, sentitext.words_lower)
 
-        return valence_dict
+        return self._contrastive_check(sentiments, ids, sentitext.words_lower,
+                                       text=sentitext.text, raw_sentences=sentitext.raw_sentences)
+
+    def _contrastive_check(self, sentiments, ids, words_lower, text=None, raw_sentences=None, vocab=None):
+        """
+        Contrastive conjunction rule over the sentiments array (changed in place and returned).
+        With but_scope='sentence' the sentence of each token comes from raw_sentences
+        (one label per whitespace token) or from segmenting text
+        """
+        if vocab is None:
+            vocab = self.vocabulary
+        if self.but_scope == 'text':
+            but_positions = np.flatnonzero(ids == vocab.id_but)
+            if len(but_positions):
+                _contrastive_adjust(sentiments, int(but_positions[0]))
+            return sentiments
+
+        but_positions = np.flatnonzero(np.isin(ids, vocab.but_ids))
+        if not len(but_positions):
+            return sentiments
+        if raw_sentences is None:
+            raw_sentences = _raw_token_sentences(text)
+        # sentence of each (merged) token: the one of its first whitespace token
+        first_raw = np.cumsum([0] + [w.count(' ') + 1 for w in words_lower[:-1]])
+        sentences = raw_sentences[first_raw]
+        for label in np.unique(sentences[but_positions]).tolist():
+            start = int(np.searchsorted(sentences, label, side='left'))
+            end = int(np.searchsorted(sentences, label, side='right'))
+            bi = int(but_positions[np.searchsorted(but_positions, start)])
+            _contrastive_adjust(sentiments[start:end], bi - start)
+        return sentiments
+
+    def _rule_valences(self, ids, is_upper, is_cap_diff, words_lower, vocab=None, valences=None):
+        # valence of each token after the caps, booster and negation rules (without 'mas')
+        # valences: list of (valence, in_lexicon) arrays over the vocab ids, one per lexicon,
+        # scored together (one row each); without it, the main lexicon (a single vector)
+        if vocab is None:
+            vocab = self.vocabulary
+        single = valences is None
+        if single:
+            valences = [(vocab.valence, vocab.in_lexicon)]
+        sentiments = np.zeros((len(valences), len(ids)))
+
+        # lexicon words (boosters are only modifiers); the lexicon-independent flags
+        # are computed once for the positions that are a word of any lexicon
+        in_lexicon = np.array([lexicon_in[ids] for _, lexicon_in in valences], dtype=bool).reshape(len(valences), len(ids))
+        is_hit = in_lexicon & ~vocab.is_booster[ids]
+        hits = np.flatnonzero(is_hit.any(axis=0))
+        if len(hits) == 0:
+            return sentiments[0] if single else sentiments
+
+        valence = np.array([lexicon_valence[ids[hits]] for lexicon_valence, _ in valences])
+
+        # check if sentiment laden word is in ALL CAPS (while others aren't)
+        if is_cap_diff:
+            valence = np.where(is_upper[hits], np.where(valence > 0, valence + C_INCR, valence - C_INCR), valence)
+
+        def preceding(distance):
+            return np.maximum(hits - distance, 0)
+
+        for start_i in range(0, 3):
+            prev = preceding(start_i + 1)
+            prev_ids = ids[prev]
+            applies = (hits > start_i) & ~in_lexicon[:, prev]
+
+            # booster/dampener scalar of the preceding word (scalar_inc_dec),
+            # dampened by its distance from the current item
+            booster = vocab.booster[prev_ids]
+            scalar = np.where(valence < 0, -booster, booster)
+            if is_cap_diff:
+                scalar = np.where(vocab.is_booster[prev_ids] & is_upper[prev],
+                                  np.where(valence > 0, scalar + C_INCR, scalar - C_INCR), scalar)
+            if start_i == 1:
+                scalar = scalar * 0.95
+            elif start_i == 2:
+                scalar = scalar * 0.9
+            valence = np.where(applies, valence + scalar, valence)
+
+            # negation (_negation_check), except after "sem duvida"
+            negate = vocab.is_negate[prev_ids]
+            if start_i == 1:
+                negate &= ~((ids[preceding(2)] == vocab.id_sem) & (ids[preceding(1)] == vocab.id_duvida))
+            elif start_i == 2:
+                negate &= ~((ids[preceding(3)] == vocab.id_sem) &
+                            ((ids[preceding(2)] == vocab.id_duvida) | (ids[preceding(1)] == vocab.id_duvida)))
+            valence = np.where(applies & negate, valence * N_SCALAR, valence)
+
+            if start_i == 2:
+                valence = self._booster_ngrams_check(valence, applies, hits, ids, words_lower, vocab)
+
+        sentiments[:, hits] = np.where(is_hit[:, hits], valence, 0.0)
+        return sentiments[0] if single else sentiments
+
+    def _booster_ngrams_check(self, valence, applies, hits, ids, words_lower, vocab):
+        # booster/dampener n-grams formed by the preceding tokens (see _special_idioms_check);
+        # only positions where those tokens are pieces of a booster expression are checked
+        # (valence and applies have one row per lexicon)
+        piece = vocab.is_booster_piece
+        p3 = piece[ids[np.maximum(hits - 3, 0)]]
+        p2 = piece[ids[np.maximum(hits - 2, 0)]]
+        p1 = piece[ids[np.maximum(hits - 1, 0)]]
+        rows, columns = np.nonzero(applies & ((p3 & p2) | (p2 & p1)))
+        for r, h in zip(rows.tolist(), columns.tolist()):
+            i = int(hits[h])
+            threetwoone = "{0} {1} {2}".format(words_lower[i - 3], words_lower[i - 2], words_lower[i - 1])
+            threetwo = "{0} {1}".format(words_lower[i - 3], words_lower[i - 2])
+            twoone = "{0} {1}".format(words_lower[i - 2], words_lower[i - 1])
+            value = valence[r, h]
+            for n_gram in [threetwoone, threetwo, twoone]:
+                if n_gram in BOOSTER_DICT:
+                    value = value + BOOSTER_DICT[n_gram]
+            valence[r, h] = value
+        return valence
 
     def sentiment_valence(self, valence, sentitext, item, i, sentiments):
         is_cap_diff = sentitext.is_cap_diff
         words_and_emoticons = sentitext.words_and_emoticons
-        item_lowercase = item.lower()
+        words_lower = sentitext.words_lower
+        item_lowercase = words_lower[i]
         if item_lowercase in self.lexicon:
             # get the sentiment valence 
             valence = self.lexicon[item_lowercase]
@@ -469,16 +1564,16 @@ class SentimentIntensityAnalyzer(object):
                 # dampen the scalar modifier of preceding words and emoticons
                 # (excluding the ones that immediately preceed the item) based
                 # on their distance from the current item.
-                if i > start_i and words_and_emoticons[i - (start_i + 1)].lower() not in self.lexicon:
+                if i > start_i and words_lower[i - (start_i + 1)] not in self.lexicon:
                     s = scalar_inc_dec(words_and_emoticons[i - (start_i + 1)], valence, is_cap_diff)
                     if start_i == 1 and s != 0:
                         s = s * 0.95
                     if start_i == 2 and s != 0:
                         s = s * 0.9
                     valence = valence + s
-                    valence = self._negation_check(valence, words_and_emoticons, start_i, i)
+                    valence = self._negation_check(valence, words_lower, start_i, i)
                     if start_i == 2:
-                        valence = self._special_idioms_check(valence, words_and_emoticons, i)
+                        valence = self._special_idioms_check(valence, words_lower, i)
 
             # n/a for portuguese
             #valence = self._least_check(valence, words_and_emoticons, i)
@@ -500,21 +1595,17 @@ class SentimentIntensityAnalyzer(object):
     @staticmethod
     def _but_check(words_and_emoticons, sentiments):
         # check for modification in sentiment due to contrastive conjunction 'but'
+        # (only 'mas' is used: the original loop over ['mas', 'entretanto', 'todavia', 'porem', 'contudo']
+        # returned right after the first conjunction)
         words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
 
-        for conjuncao in ['mas', 'entretanto', 'todavia', 'porem', 'contudo']:
-            if conjuncao in words_and_emoticons_lower:
-                bi = words_and_emoticons_lower.index(conjuncao)
-                for sentiment in sentiments:
-                    si = sentiments.index(sentiment)
-                    # limitamos a distancia pois nao pode ser feito para texto grande
-                    if si < bi and (bi-si) < 10:
-                        sentiments.pop(si)
-                        sentiments.insert(si, sentiment * 0.5)
-                    elif si > bi and (si-bi) < 10:
-                        sentiments.pop(si)
-                        sentiments.insert(si, sentiment * 1.5)
-            return sentiments
+        if BUT_WORD in words_and_emoticons_lower:
+            bi = words_and_emoticons_lower.index(BUT_WORD)
+            # limitamos a distancia pois nao pode ser feito para texto grande
+            adjusted = np.array(sentiments, dtype=np.float64)
+            _contrastive_adjust(adjusted, bi)
+            sentiments = adjusted.tolist()
+        return sentiments
 
     @staticmethod
     def _special_idioms_check(valence, words_and_emoticons, i):
@@ -595,17 +1686,18 @@ class SentimentIntensityAnalyzer(object):
                 valence = valence * N_SCALAR
         return valence
 
-    def _punctuation_emphasis(self, text):
+    def _punctuation_emphasis(self, text, ep_count=None, qm_count=None):
         # add emphasis from exclamation points and question marks
-        ep_amplifier = self._amplify_ep(text)
-        qm_amplifier = self._amplify_qm(text)
+        ep_amplifier = self._amplify_ep(text, ep_count)
+        qm_amplifier = self._amplify_qm(text, qm_count)
         punct_emph_amplifier = ep_amplifier + qm_amplifier
         return punct_emph_amplifier
 
     @staticmethod
-    def _amplify_ep(text):
+    def _amplify_ep(text, ep_count=None):
         # check for added emphasis resulting from exclamation points (up to 4 of them)
-        ep_count = text.count("!")
+        if ep_count is None:
+            ep_count = text.count("!")
         if ep_count > 4:
             ep_count = 4
         # (empirically derived mean sentiment intensity rating increase for
@@ -614,9 +1706,10 @@ class SentimentIntensityAnalyzer(object):
         return ep_amplifier
 
     @staticmethod
-    def _amplify_qm(text):
+    def _amplify_qm(text, qm_count=None):
         # check for added emphasis resulting from question marks (2 or 3+)
-        qm_count = text.count("?")
+        if qm_count is None:
+            qm_count = text.count("?")
         qm_amplifier = 0
         if qm_count > 1:
             if qm_count <= 3:
@@ -644,17 +1737,23 @@ class SentimentIntensityAnalyzer(object):
 
     def score_valence(self, sentiments, text):
         if sentiments:
-            sum_s = float(sum(sentiments))
+            # discriminate between positive, negative and neutral sentiment scores
+            pos_sum, neg_sum, neu_count = self._sift_sentiment_scores(sentiments)
             # compute and add emphasis from punctuation in text
-            punct_emph_amplifier = self._punctuation_emphasis(text)
+            return self._scores_from_sums(float(sum(sentiments)), pos_sum, neg_sum, neu_count,
+                                          self._punctuation_emphasis(text))
+        return self._scores_from_sums(None, 0.0, 0.0, 0, 0.0)
+
+    @staticmethod
+    def _scores_from_sums(sum_s, pos_sum, neg_sum, neu_count, punct_emph_amplifier):
+        # final scores from the sums of the sentiments (sum_s is None when there are no tokens)
+        if sum_s is not None:
             if sum_s > 0:
                 sum_s += punct_emph_amplifier
             elif sum_s < 0:
                 sum_s -= punct_emph_amplifier
 
             compound = normalize(sum_s)
-            # discriminate between positive, negative and neutral sentiment scores
-            pos_sum, neg_sum, neu_count = self._sift_sentiment_scores(sentiments)
 
             if pos_sum > math.fabs(neg_sum):
                 pos_sum += punct_emph_amplifier
@@ -679,6 +1778,164 @@ class SentimentIntensityAnalyzer(object):
 
         return sentiment_dict
 
+    # #Streaming# #
+
+    def polarity_scores_stream(self, source, block_size=65536):
+        """
+        Score a (possibly huge) text or file-like object reading it in blocks cut
+        at sentence ends. Only the state needed across blocks is kept: the tokens
+        waiting for the n-gram lookahead, the 3 preceding tokens of the booster/negation
+        windows and the window around the first 'mas'. Since the caps rule depends on the
+        whole text, valences are kept for both outcomes and the right one is chosen at the end.
+        Same result as polarity_scores (up to the summation order of the floats)
+        """
+        if self.but_scope != 'text':
+            raise ValueError("polarity_scores_stream only supports but_scope='text'")
+        if isinstance(source, str):
+            source = StringIO(source)
+        vocab = self.vocabulary
+
+        pending, pending_lower = [], []
+        context_lower, context_ids, context_upper = [], np.zeros(0, dtype=np.intp), np.zeros(0, dtype=bool)
+        n_tokens = allcap_words = ep_count = qm_count = 0
+        streams = {False: _ContrastStream(), True: _ContrastStream()}
+
+        buffer = ''
+        finished = False
+        while not finished:
+            data = source.read(block_size)
+            finished = not data
+            if finished:
+                block, buffer = buffer, ''
+            else:
+                block, buffer = _split_block(buffer + data)
+                if not block:
+                    continue
+
+            text = self.preprocess(block)
+            ep_count += text.count("!")
+            qm_count += text.count("?")
+
+            words = [SentiText._strip_punc_if_word(w) for w in text.split()]
+            pending.extend(words)
+            pending_lower.extend(w.lower() for w in words)
+            # n-grams may still continue in the next block
+            stop = None if finished else len(pending) - (NGRAM_MAX_LENGTH - 1)
+            merged, merged_lower, consumed = _merge_ngrams(pending, pending_lower, self.ngram_matcher, stop=stop)
+            del pending[:consumed]
+            del pending_lower[:consumed]
+            if not merged:
+                continue
+
+            ids = vocab.intern(merged_lower)
+            is_upper = np.array([w.isupper() for w in merged], dtype=bool)
+            n_tokens += len(merged)
+            allcap_words += int(is_upper.sum())
+
+            # the preceding tokens take part in the windows of the first ones
+            offset = len(context_lower)
+            words_lower = context_lower + merged_lower
+            all_ids = np.concatenate([context_ids, ids])
+            all_upper = np.concatenate([context_upper, is_upper])
+            is_but = ids == vocab.id_but
+            if all_upper.any():
+                for is_cap_diff, stream in streams.items():
+                    stream.push(self._rule_valences(all_ids, all_upper, is_cap_diff, words_lower)[offset:], is_but)
+            else:
+                values = self._rule_valences(all_ids, all_upper, False, words_lower)[offset:]
+                for stream in streams.values():
+                    stream.push(values, is_but)
+
+            context_lower = words_lower[-3:]
+            context_ids = all_ids[-3:]
+            context_upper = all_upper[-3:]
+
+        if n_tokens == 0:
+            return self._scores_from_sums(None, 0.0, 0.0, 0, 0.0)
+        stream = streams[0 < allcap_words < n_tokens]
+        sum_s, pos_sum, neg_sum, neu_count = stream.sums()
+        return self._scores_from_sums(sum_s, pos_sum, neg_sum, neu_count,
+                                      self._punctuation_emphasis(None, ep_count, qm_count))
+
+    def polarity_scores_batch(self, texts, n_jobs=-1, chunksize=None):
+        """
+        Score a collection of texts using a pool of worker processes.
+        The analyzer (with its lexicon already loaded) is sent once to each
+        worker and the input order is kept.
+        :param texts: list or pandas Series of texts
+        :param int n_jobs: number of worker processes (-1 uses all cores, 1 runs in-process)
+        :param int chunksize: number of texts sent to a worker at a time
+        :returns: DataFrame with columns neg, neu, pos and compound
+        """
+        index = texts.index if isinstance(texts, pd.Series) else None
+        texts = list(texts)
+
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = max(1, min(n_jobs, len(texts)))
+
+        if n_jobs == 1:
+            rows = [_scores_row(self.polarity_scores(t)) for t in texts]
+        else:
+            if chunksize is None:
+                # ~4 chunks per worker balances load without too much IPC
+                chunksize = max(1, math.ceil(len(texts) / (n_jobs * 4)))
+            with Pool(n_jobs, initializer=_init_batch_worker, initargs=(self,)) as pool:
+                rows = pool.map(_score_batch_item, texts, chunksize=chunksize)
+
+        return pd.DataFrame(np.array(rows, dtype=float).reshape(len(rows), 4),
+                            columns=SCORE_COLUMNS, index=index)
+
+
+# #Shared analyzer# #
+
+_shared_analyzers = {}
+_shared_analyzers_lock = threading.Lock()
+
+# size of the score cache of the shared analyzers
+SHARED_CACHE_SIZE = 10000
+# size of the sentence front-end cache of the shared analyzers
+SHARED_SENTENCE_CACHE_SIZE = 20000
+
+
+def shared_analyzer(lexicon_file="datasets/vader_lexico_ptbr.txt", emoji_lexicon="datasets/emoji_utf8_lexicon.txt"):
+    """
+    Analyzer shared by the whole process, created once per lexicon (with the score and sentence caches).
+    When created before forking (e.g. polarity_scores_batch) the workers
+    reuse the parent's pages instead of loading the lexicon again
+    """
+    key = (lexicon_file, emoji_lexicon)
+    analyzer = _shared_analyzers.get(key)
+    if analyzer is None:
+        with _shared_analyzers_lock:
+            analyzer = _shared_analyzers.get(key)
+            if analyzer is None:
+                analyzer = SentimentIntensityAnalyzer(lexicon_file, emoji_lexicon, cache_size=SHARED_CACHE_SIZE,
+                                                      sentence_cache_size=SHARED_SENTENCE_CACHE_SIZE)
+                _shared_analyzers[key] = analyzer
+    return analyzer
+
+
+# #Batch scoring helpers# #
+
+SCORE_COLUMNS = ['neg', 'neu', 'pos', 'compound']
+
+# analyzer owned by each worker of polarity_scores_batch
+_batch_analyzer = None
+
+
+def _scores_row(sentiment_dict):
+    return [sentiment_dict[c] for c in SCORE_COLUMNS]
+
+
+def _init_batch_worker(analyzer):
+    global _batch_analyzer
+    _batch_analyzer = analyzer
+
+
+def _score_batch_item(text):
+    return _scores_row(_batch_analyzer.polarity_scores(text))
+
 
 
 if __name__ == '__main__':